@@ -0,0 +1,46 @@
+""" Benchmark of the per-message overhead and memory of the anti-spam tracker,
+    run from the repository root: python benchmarks/anti_spam.py """
+import os
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cogs.events import SpamTracker
+
+MESSAGES = 500000
+MEMBERS = 200000
+CHANNELS = 20
+
+
+def make_messages():
+    """ Function to build messages from MEMBERS members across CHANNELS channels, a few with mentions """
+    channels = [SimpleNamespace(id=number) for number in range(CHANNELS)]
+    authors = [SimpleNamespace(id=number) for number in range(MEMBERS)]
+    return [SimpleNamespace(channel=random.choice(channels), author=random.choice(authors),
+                            mentions=[None] * random.choice((0, 0, 0, 1, 2)), attachments=[])
+            for _ in range(MESSAGES)]
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    messages = make_messages()
+    settings = dict(SpamTracker.defaults)
+    tracker = SpamTracker()
+
+    start = time.perf_counter()
+    for message in messages:
+        tracker.check(message, settings)
+    elapsed = time.perf_counter() - start
+    print(f"{elapsed / MESSAGES * 1e6:.2f} us per message over {MESSAGES:,} messages")
+
+    tracemalloc.start()
+    tracker = SpamTracker()
+    for message in messages:
+        tracker.check(message, settings)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{len(tracker.windows):,} windows and {len(tracker.strikes):,} strike counters "
+          f"tracked in {current / 1024 / 1024:.1f} MB (max_tracked {settings['max_tracked']:,})")
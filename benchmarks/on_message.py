@@ -0,0 +1,84 @@
+""" Benchmark of Events.on_message throughput with the in-memory config store, run from the repository root:
+    python benchmarks/on_message.py
+
+    "parsing on every read" runs the current on_message with methods._load_json swapped for a plain json.load,
+    so every config lookup the handler makes parses the file again. It doesn't bring back the old handler's
+    get_filtered() call for every word of a message, "old per-word filter" times just that loop on its own """
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import methods
+from cogs.events import Events, SpamTracker
+
+MESSAGES = 20000
+
+
+class FakeMessage:
+    """ Message stand-in with just the attributes on_message reads """
+
+    def __init__(self, number, content):
+        """ Initialization method, every message comes from a different member so anti-spam never triggers """
+        self.guild = SimpleNamespace(id=1)
+        self.author = SimpleNamespace(id=number, bot=False, guild_permissions=SimpleNamespace(administrator=False))
+        self.channel = SimpleNamespace(id=1)
+        self.content = content
+        self.mentions = []
+        self.attachments = []
+
+    async def delete(self):
+        """ Method to stand in for deleting the message """
+
+
+def make_events():
+    """ Function to build the cog without starting its background tasks """
+    events = Events.__new__(Events)
+    events.bot = SimpleNamespace(user=SimpleNamespace(id=0), get_command=lambda name: None)
+    events.spam_tracker = SpamTracker()
+    return events
+
+
+async def run(label):
+    """ Function to time MESSAGES messages, every tenth one starts with the prefix """
+    events = make_events()
+    prefix = methods.get_prefix()
+    messages = [FakeMessage(number, f"{prefix}unknown" if number % 10 == 0 else f"hello there number {number}")
+                for number in range(MESSAGES)]
+    start = time.perf_counter()
+    for message in messages:
+        await events.on_message(message)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {MESSAGES / elapsed:,.0f} messages/sec")
+
+
+async def run_old_filter(label):
+    """ Function to time the old filter loop, which parsed config.json again for every word of a message """
+    prefix = methods.get_prefix()
+    contents = [f"{prefix}unknown" if number % 10 == 0 else f"hello there number {number}"
+                for number in range(MESSAGES)]
+    start = time.perf_counter()
+    for content in contents:
+        for word in content.split(" "):
+            if word in parse_every_read(methods.CONFIG_FILE)["filtered_words"]:
+                pass
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {MESSAGES / elapsed:,.0f} messages/sec")
+
+
+def parse_every_read(path):
+    """ Function to parse a json file on every call, the way the bot read its files before the in-memory store """
+    with open(path, encoding="UTF-8") as i:
+        return json.load(i)
+
+
+if __name__ == "__main__":
+    load_json = methods._load_json
+    methods._load_json = parse_every_read
+    asyncio.run(run("parsing on every read"))
+    methods._load_json = load_json
+    asyncio.run(run_old_filter("old per-word filter"))
+    asyncio.run(run("in-memory store"))
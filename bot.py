@@ -1,28 +1,35 @@
 ﻿""" Main bot file, run this file to start the bot """
-import json
-
 import discord
 from discord.ext import commands
 import methods
 
 
 def get_prefix(_bot, _message):
-    """ Function to get the prefix for dynamic updating """
-    try:
-        with open(CONFIG_FILE) as i:
-            prefix_data = json.load(i)
-            return prefix_data["prefix"]
+    """ Function to get the prefix for dynamic updating, served from the in-memory config """
+    return methods.get_prefix()
+
+
+class Bot(commands.Bot):
+    """ Bot class that lets the cogs send any buffered work before the connection is closed """
+
+    async def close(self):
+        """ Method called on shutdown, awaits each cog's cog_shutdown before unloading the cogs """
+        for cog in tuple(self.cogs.values()):
+            shutdown = getattr(cog, "cog_shutdown", None)
+            if shutdown is not None:
+                try:
+                    await shutdown()
+
+                except Exception as error:
+                    print(f"Error while shutting down {cog.qualified_name}: {error}")
 
-    except FileNotFoundError as error:
-        print(error)
+        await super().close()
 
 
 intents = discord.Intents(messages=True, guilds=True, members=True, reactions=True)
-bot = commands.Bot(command_prefix=get_prefix, case_insensitive=True, reconnect=True,
-                   check="blacklist_check", intents=intents)
+bot = Bot(command_prefix=get_prefix, case_insensitive=True, reconnect=True,
+          check="blacklist_check", intents=intents)
 bot.remove_command("help")
-CONFIG_FILE = "data/config.json"
-BLACKLISTED_FILE = "data/blacklisted.json"
 data = methods.get_config()
 cogs = [
     "cogs.events",
@@ -42,6 +49,8 @@ async def on_ready():
     prefix = config["prefix"]
     status = config["playing_status"]
     online_status = config["online_status"]
+    methods.migrate_blacklisted(bot.get_all_members())
+    methods.migrate_reaction_roles(bot.guilds)
 
     if status != "" and online_status != "":
         activity = discord.Activity(name=status, type=discord.ActivityType.playing)
@@ -60,9 +69,7 @@ async def on_ready():
 @bot.check
 async def blacklist_check(ctx):
     """ Check that bot uses every time it is called to see if a user is blacklisted """
-    with open(BLACKLISTED_FILE) as blacklisted_file:
-        blacklisted = json.load(blacklisted_file)
-    return f"{ctx.message.author}" not in blacklisted["user"]
+    return not methods.is_blacklisted(ctx.author)
 
 
 if __name__ == '__main__':
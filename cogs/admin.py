@@ -1,4 +1,6 @@
 """ Admin Commands cog that defines all the admin commands """
+import re
+
 import discord
 from discord.ext import commands
 from discord.ext.commands import has_permissions
@@ -22,6 +24,10 @@ class Admin(commands.Cog):
             "cogs.help",
             "cogs.admin"
         ]
+        self.broadcast_concurrency = 5
+        self.job_permissions = {"broadcast": "administrator", "roles": "manage_roles", "unban": "manage_guild"}
+        self.job_runner = methods.JobRunner(bot, {"broadcast": self.run_broadcast})
+        self.bot.loop.create_task(self.job_runner.resume())
         print(f"{self.__class__.__name__} cog loaded.")
 
     @commands.command(help="", description="Reloads the bot's cogs.")
@@ -43,14 +49,11 @@ class Admin(commands.Cog):
     @has_permissions(administrator=True)
     async def blacklist(self, ctx, member: discord.Member):
         """ Admin command to blacklist a user from using the bot's commands """
-        blacklisted = methods.get_blacklisted()
         if member.guild_permissions.administrator:
             description = "Cannot blacklist a user with administrator permissions."
-            await ctx.send(methods.return_error(self, ctx, error=description))
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-        elif f"{member}" not in blacklisted["user"]:
-            blacklisted["user"].append(f"{member}")
-            methods.set_blacklisted(blacklisted)
+        elif methods.add_blacklisted(member):
             title = "**__Blacklist__**"
             description = f"{member.mention} was blacklisted from using all bot commands."
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
@@ -64,11 +67,7 @@ class Admin(commands.Cog):
     @has_permissions(administrator=True)
     async def unblacklist(self, ctx, member: discord.Member):
         """ Admin command to unblacklist a user from the bot """
-        blacklisted = methods.get_blacklisted()
-        if f"{member}" in blacklisted["user"]:
-            index = blacklisted["user"].index(f"{member}")
-            del blacklisted["user"][index]
-            methods.set_blacklisted(blacklisted)
+        if methods.remove_blacklisted(member):
             title = "**__Blacklist__**"
             description = f"{member.mention} was removed from the blacklist."
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
@@ -76,22 +75,124 @@ class Admin(commands.Cog):
         else:
             await ctx.send(embed=methods.return_error(self, ctx, error=f"{member.mention} isn't blacklisted."))
 
-    @commands.command(help="<message>", description="DM's all users in the discord the message.")
+    def cog_unload(self):
+        """ Method called when the cog is unloaded to stop any broadcasts, they are resumed when the cog is loaded """
+        self.job_runner.stop()
+
+    async def run_broadcast(self, guild, message, job_id, options, done=0, failed=0, skip=()):
+        """ Method to DM the broadcast's embed to every member matching its role and status filters,
+            members that were already messaged are skipped when a broadcast is resumed """
+        embed = discord.Embed.from_dict(options["embed"])
+        roles = set(options["roles"])
+        statuses = set(options["statuses"])
+        if statuses and not self.bot.intents.presences:
+            print(f"Cancelled broadcast {job_id}, its status filter needs the presence intent.")
+            await methods.save_job(job_id, (), done, failed, status="cancelled")
+            return
+
+        items = [(member.id, member) for member in guild.members
+                 if not member.bot and member.id not in skip
+                 and (not roles or any(role.id in roles for role in member.roles))
+                 and (not statuses or str(member.status) in statuses)]
+
+        progress = methods.job_progress(self, "**__Announcement__**", message, "members messaged")
+        job = methods.BulkJob(job_id, items, lambda member: member.send(embed=embed),
+                              concurrency=self.broadcast_concurrency, progress=progress, done=done, failed=failed)
+        await job.run()
+
+    @commands.command(help="[role:name] [status:online] <message>\n\nStart with any number of role (name or "
+                           "mention) and status filters, the status filter needs the presence intent.",
+                      description="DM's all users in the discord the message.")
     @commands.guild_only()
     @has_permissions(administrator=True)
     async def messageall(self, ctx, *, message):
-        """ Sends the message to all members in the server with the role """
-        members = set(ctx.message.guild.members)
-        for user in members:
-            try:
-                await user.send(embed=methods.return_embed(self, ctx, title="**__Announcement__**", description=message,
-                                                           color="pink"))
-            except discord.errors.Forbidden:
-                pass
+        """ Sends the message to all members in the server matching the filters, the messages are sent in the
+            background and the broadcast is resumed after a restart """
+        roles, statuses = [], []
+        words = message.split(" ")
+        while words:
+            key, _, value = words[0].partition(":")
+            mention = re.fullmatch(r"<@&(\d+)>", words[0])
+            role = ctx.guild.get_role(int(mention.group(1))) if mention is not None else None
+            if key == "role" and value:
+                role = discord.utils.get(ctx.guild.roles, name=value)
+                if role is None:
+                    await ctx.send(embed=methods.return_error(self, ctx, error=f"No role is named `{value}`."))
+                    return
+            elif key == "status" and value in ("online", "idle", "dnd", "offline"):
+                statuses.append(value)
+            elif role is None:
+                break
+
+            if role is not None:
+                roles.append(role.id)
+            words.pop(0)
+
+        if not words:
+            await ctx.send(embed=methods.return_error(self, ctx, error="No message was given."))
+            return
+
+        if statuses and not self.bot.intents.presences:
+            description = "Status filters need the presence intent, without it every member looks offline."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+            return
+
+        embed = methods.return_embed(self, ctx, title="**__Announcement__**", description=" ".join(words),
+                                     color="pink")
+        options = {"embed": embed.to_dict(), "roles": roles, "statuses": statuses}
+        title = "**__Announcement__**"
+        progress = await ctx.send(embed=methods.return_embed(self, ctx, title, "Starting to message members...",
+                                                             color="pink"))
+        job_id = await methods.create_job("broadcast", ctx.guild.id, ctx.channel.id, progress.id, options)
+        self.job_runner.start(self.run_broadcast(ctx.guild, progress, job_id, options))
+
+    def visible_jobs(self, ctx, rows):
+        """ Method to keep the jobs whose kind's permission the author has, so moderators can manage their own """
+        permissions = ctx.author.guild_permissions
+        return [row for row in rows if permissions.administrator or getattr(permissions, self.job_permissions[row[1]])]
+
+    @commands.command(help="", description="Shows the progress of the running bulk jobs, like messageall.")
+    @commands.guild_only()
+    @commands.check_any(has_permissions(administrator=True), has_permissions(manage_roles=True),
+                        has_permissions(manage_guild=True))
+    async def jobs(self, ctx):
+        """ Admin command to list the guild's unfinished bulk jobs and their progress """
+        lines = []
+        for job_id, kind, done, failed in self.visible_jobs(ctx, await methods.get_guild_jobs(ctx.guild.id)):
+            job = methods.BulkJob.running.get(job_id)
+            if job is not None:
+                lines.append(f"**#{job_id}** {kind} - {job.done}/{job.total} done, {job.failed} failed")
+            else:
+                lines.append(f"**#{job_id}** {kind} - {done} done, {failed} failed (waiting to resume)")
 
-        title = "**__Success__**"
-        description = "Message sent to all users."
-        await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
+        if not lines:
+            await ctx.send(embed=methods.return_error(self, ctx, error="There are no jobs running."))
+
+        else:
+            title = "__Jobs__"
+            description = "\n".join(lines) + f"\n\nUse **{methods.get_prefix()}canceljob <id>** to stop one."
+            await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="blue"))
+
+    @commands.command(help="<id>", description="Cancels a running bulk job.", aliases=["jobcancel"])
+    @commands.guild_only()
+    @commands.check_any(has_permissions(administrator=True), has_permissions(manage_roles=True),
+                        has_permissions(manage_guild=True))
+    async def canceljob(self, ctx, job_id: int = None):
+        """ Admin command to cancel one of the guild's bulk jobs, the items already in progress are finished """
+        jobs = {row[0]: row for row in self.visible_jobs(ctx, await methods.get_guild_jobs(ctx.guild.id))}
+        if job_id not in jobs:
+            await ctx.send(embed=methods.return_error(self, ctx, error="No running job has that id."))
+
+        else:
+            job = methods.BulkJob.running.get(job_id)
+            if job is not None:
+                job.cancel()
+            else:
+                await methods.save_job(job_id, [], jobs[job_id][2], jobs[job_id][3], "cancelled")
+
+            title = "__Job Cancelled__"
+            description = f"Job **#{job_id}** ({jobs[job_id][1]}) was cancelled."
+            await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
     @commands.command(help="<status>", description="Admin command to change the bot's online status.")
     @has_permissions(administrator=True)
@@ -222,33 +323,31 @@ class Admin(commands.Cog):
         """ Admin command to add a word to the filter list """
         if word is None:
             await ctx.send(embed=methods.return_error(self, ctx, error="No word given to filter."))
-        else:
-            config = methods.get_config()
-            config["filtered_words"].append(word)
-            methods.set_config(config)
+
+        elif methods.add_filtered_word(word):
             title = "__Filter Added__"
             description = f"'{word}' was added to the filtered list."
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
+        else:
+            description = f"'{word}' is already filtered."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+
     @commands.command(help="<word>", description="Sets words to be auto-deleted when they are sent in the discord.")
     @has_permissions(administrator=True)
     async def filterremove(self, ctx, word=None):
         """ Admin command to remove a word from the filter list """
         if word is None:
             await ctx.send(embed=methods.return_error(self, ctx, error="No word given to remove from the filter list."))
-        else:
-            config = methods.get_config()
-            if word in config["filtered_words"]:
-                index = config["filtered_words"].index(word)
-                del config["filtered_words"][index]
-                methods.set_config(config)
-                title = "__Filter Removed__"
-                description = f"'{word}' was removed from the filtered list."
-                await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
-            else:
-                description = f"'{word}' is not currently filtered."
-                await ctx.send(embed=methods.return_error(self, ctx, error=description))
+        elif methods.remove_filtered_word(word):
+            title = "__Filter Removed__"
+            description = f"'{word}' was removed from the filtered list."
+            await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
+
+        else:
+            description = f"'{word}' is not currently filtered."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
     @commands.command(help="", description="Shows the list of words that get auto-deleted.",
                       aliases=["filteredwords", "filterlist"])
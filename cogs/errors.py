@@ -17,9 +17,9 @@ class Errors(commands.Cog):
     async def on_command_error(self, ctx, error):
         """ Event to catch any errors that are caused when a command is called """
         config = methods.get_config()
-        msg = ctx.message.content.replace(config["prefix"], "").lower()
+        msg = (ctx.message.content[len(config["prefix"]):].lower().split(" "))[0]
 
-        if msg in methods.get_cmds():
+        if msg in methods.get_cmds()["commands"]:
             pass
 
         elif isinstance(error, commands.errors.CommandNotFound):
@@ -1,7 +1,11 @@
 """ Events cog that catches all events and checks if they are used or not """
+import asyncio
+import time
+from collections import OrderedDict, deque
+
 import discord
 from discord.ext import commands
-from discord.utils import get, find
+from discord.utils import get
 import methods
 
 
@@ -22,8 +26,169 @@ class Events(commands.Cog):
             "cogs.help",
             "cogs.admin"
         ]
+        self.spam_tracker = SpamTracker()
+        self.log_queue = deque()
+        self.log_queue_size = 500
+        self.log_batch_size = 10
+        self.log_flush_seconds = 5
+        self.logs_dropped = 0
+        self.log_wakeup = asyncio.Event()
+        self.log_task = self.bot.loop.create_task(self.log_worker())
+        self.sync_defaults = {"enabled": True, "remove_unreacted": False, "concurrency": 4, "timeout_seconds": 900}
+        self.sync_task = None
         print(f"{self.__class__.__name__} cog loaded.")
 
+    def cog_unload(self):
+        """ Method called when the cog is unloaded to stop the log worker and send anything still queued """
+        self.log_task.cancel()
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+        if self.log_queue:
+            self.bot.loop.create_task(self.flush_logs())
+
+    async def cog_shutdown(self):
+        """ Method called by the bot before it disconnects to send the queued command logs """
+        await self.flush_logs()
+
+    async def log_worker(self):
+        """ Background task that sends the queued command logs once a batch is full or every few seconds """
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                await asyncio.wait_for(self.log_wakeup.wait(), timeout=self.log_flush_seconds)
+
+            except asyncio.TimeoutError:
+                pass
+
+            self.log_wakeup.clear()
+            await self.flush_logs()
+
+    def queue_log(self, message):
+        """ Method to queue a command for the logging channel, new entries are dropped and counted while
+            the queue is full so a slow logging channel can't hold up anything else """
+        if len(self.log_queue) >= self.log_queue_size:
+            self.logs_dropped += 1
+        else:
+            timestamp = message.created_at.strftime(self.time_format)
+            self.log_queue.append((timestamp, message.author.mention, message.channel.mention, message.content))
+            if len(self.log_queue) >= self.log_batch_size:
+                self.log_wakeup.set()
+
+    async def flush_logs(self):
+        """ Method to send the queued command logs as embeds with one field per command """
+        channel = self.bot.get_channel(methods.get_config()["logging_channel_id"])
+        while self.log_queue:
+            batch = [self.log_queue.popleft() for _ in range(min(self.log_batch_size, len(self.log_queue)))]
+            if channel is None:
+                continue
+
+            embed = discord.Embed(title="__Logged Commands__", color=self.colors.get("green"))
+            for timestamp, author, channel_mention, content in batch:
+                value = f"{author} in {channel_mention}\n{content}"
+                embed.add_field(name=f"**{timestamp}**", value=value[:500], inline=False)
+
+            footer = f"{self.bot.user.name} | {len(batch)} commands"
+            if self.logs_dropped:
+                footer += f" | {self.logs_dropped} dropped while the queue was full"
+                self.logs_dropped = 0
+            embed.set_footer(text=footer, icon_url=self.bot.user.avatar_url)
+
+            try:
+                await channel.send(embed=embed)
+
+            except discord.HTTPException as error:
+                print(f"Failed to send command logs: {error}")
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """ Event method called when the bot connects, reactions changed while it was offline never reach the
+            reaction events so the reaction roles are reconciled, unless a reconciliation is still running """
+        if self.sync_task is None or self.sync_task.done():
+            self.sync_task = self.bot.loop.create_task(self.sync_reaction_roles())
+
+    async def sync_reaction_roles(self):
+        """ Method to run the reaction-role reconciliation with the configured time limit """
+        settings = {**self.sync_defaults, **methods.get_config().get("reaction_role_sync", {})}
+        if settings["enabled"]:
+            try:
+                await asyncio.wait_for(self.reconcile_reaction_roles(settings), timeout=settings["timeout_seconds"])
+
+            except asyncio.TimeoutError:
+                print(f"Reaction role sync stopped after {settings['timeout_seconds']} seconds, "
+                      f"the remaining members will be updated as they react.")
+
+    async def reconcile_reaction_roles(self, settings):
+        """ Method to page through the reactions of every reaction-role message, diff them against each role's
+            members and give each member that changed a single role edit, with a few edits in flight at a time,
+            roles on a message that couldn't be read are only ever added so their reactors don't lose them """
+        reacted, incomplete = {}, set()
+        entries = (methods.get_reaction_roles() or {}).get("reaction_messages", [])
+        for number, entry in enumerate(entries, 1):
+            reaction_roles = methods.get_reaction_message(entry["message_id"])
+            channel = self.bot.get_channel(entry.get("channel_id"))
+            if channel is None or not reaction_roles:
+                incomplete.update((reaction_roles or {}).values())
+                print(f"Reaction role sync skipped message {entry['message_id']}, its channel is unknown.")
+                continue
+
+            for role_id in reaction_roles.values():
+                reacted.setdefault((channel.guild, role_id), set())
+
+            count = 0
+            try:
+                message = await channel.fetch_message(entry["message_id"])
+                for reaction in message.reactions:
+                    role_id = reaction_roles.get(methods.emoji_key(reaction.emoji))
+                    if role_id is not None:
+                        async for user in reaction.users(limit=None):
+                            reacted[(channel.guild, role_id)].add(user.id)
+                            count += 1
+
+            except discord.HTTPException as error:
+                incomplete.update(reaction_roles.values())
+                print(f"Reaction role sync skipped message {entry['message_id']}: {error}")
+                continue
+
+            print(f"Reaction role sync read {count} reactions from message {number}/{len(entries)}.")
+
+        changes = {}
+        for (guild, role_id), user_ids in reacted.items():
+            role = guild.get_role(role_id)
+            if role is None:
+                continue
+
+            user_ids.discard(self.bot.user.id)
+            holders = {member.id for member in role.members}
+            for user_id in user_ids - holders:
+                member = guild.get_member(user_id)
+                if member is not None:
+                    changes.setdefault((guild.id, user_id), (member, [], []))[1].append(role)
+
+            if settings["remove_unreacted"] and role_id not in incomplete:
+                for user_id in holders - user_ids:
+                    member = guild.get_member(user_id)
+                    changes.setdefault((guild.id, user_id), (member, [], []))[2].append(role)
+
+        pending = iter(changes.values())
+        progress = {"done": 0, "failed": 0}
+
+        async def worker():
+            for member, added, removed in pending:
+                roles = [role for role in member.roles[1:] if role not in removed] + added
+                try:
+                    await member.edit(roles=roles, reason="Reaction role sync")
+
+                except discord.HTTPException as error:
+                    progress["failed"] += 1
+                    print(f"Reaction role sync couldn't update {member}: {error}")
+
+                progress["done"] += 1
+                if progress["done"] % 100 == 0:
+                    print(f"Reaction role sync updated {progress['done']}/{len(changes)} members.")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, settings["concurrency"]))))
+        print(f"Reaction role sync finished, {progress['done'] - progress['failed']}/{len(changes)} members updated.")
+
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         """ Event method called when a user joins the guild """
@@ -54,7 +219,7 @@ class Events(commands.Cog):
         if payload.user_id != self.bot.user.id:
             config = methods.get_config()
             ticket_setup_id = config["ticket_setup_id"]
-            guild = find(lambda g: g.id == payload.guild_id, self.bot.guilds)
+            guild = self.bot.get_guild(payload.guild_id)
 
             if payload.message_id == ticket_setup_id and payload.emoji.name == "✅":
                 user = self.bot.get_user(payload.user_id)
@@ -62,32 +227,29 @@ class Events(commands.Cog):
                 message = await channel.fetch_message(payload.message_id)
                 await message.remove_reaction(str(payload.emoji), user)
 
-                select = """ SELECT ticket_id, user_id FROM tickets; """
-                data = methods.send_query(select)
+                category = get(guild.categories, name="tickets")
 
-                tuples = list(zip(*data))
-                tickets = [] if tuples == [] else tuples[0]
-                user_ids = [] if tuples == [] else tuples[1]
-                ticket_number = int(max(tickets)) if tickets != [] else 1000
-                category_check = bool(get(guild.categories, name="tickets"))
+                if category is None:
+                    description = """There is no category named `tickets` for the channel to be created, 
+                                    please create one and set your permissions correctly."""
+                    await user.send(embed=methods.return_error(self, message, error=description))
+                    return
 
-                if user.id in user_ids:
+                ticket_number = await methods.reserve_ticket(user.id)
+                if ticket_number is None:
                     description = """You already have a ticket open, 
                                     this ticket must be closed before you can open another."""
                     await user.send(embed=methods.return_error(self, message, error=description))
 
-                elif not category_check:
-                    description = """There is no category named `tickets` for the channel to be created, 
-                                    please create one and set your permissions correctly."""
-                    await user.send(embed=methods.return_error(self, message, error=description))
+                else:
+                    try:
+                        channel = await guild.create_text_channel(f"ticket-{ticket_number}", category=category)
+                        await methods.add_ticket(ticket_number, user.id, channel.id)
+                        self.bot.dispatch("ticket_open", channel)
 
-                elif user.id not in user_ids and (ticket_number + 1) not in tickets:
-                    ticket_number += 1
-                    ticket_channel = f"ticket-{ticket_number}"
-                    category = get(guild.categories, name="tickets")
+                    finally:
+                        methods.release_ticket(user.id)
 
-                    ticket = await guild.create_text_channel(ticket_channel, category=category)
-                    channel = self.bot.get_channel(ticket.id)
                     overwrite = discord.PermissionOverwrite(send_messages=True, read_messages=True,
                                                             read_message_history=True)
                     await channel.set_permissions(user, overwrite=overwrite)
@@ -99,10 +261,6 @@ class Events(commands.Cog):
                     description = f"**A ticket channel has been created for you in** `{guild.name}`"
                     await user.send(embed=methods.return_embed(self, message, title, description, color="green"))
 
-                    insert = f""" INSERT INTO tickets(ticket_id, user_id, channel_id)
-                                VALUES({ticket_number}, {user.id}, {channel.id}) """
-                    methods.send_query(insert)
-
             elif payload.message_id == ticket_setup_id and payload.emoji.name != "✅":
                 channel = self.bot.get_channel(payload.channel_id)
                 message = await channel.fetch_message(payload.message_id)
@@ -110,123 +268,152 @@ class Events(commands.Cog):
                 await message.remove_reaction(str(payload.emoji), user)
 
             else:
-                reactions = (methods.get_reaction_roles())["reaction_messages"]
-                for message in reactions:
-                    if payload.message_id == message.get("message_id"):
-                        roles = message.get("reaction_roles")
-                        emojis = message.get("reaction_emojis")
-
-                        if payload.emoji.name in emojis:
-                            index = index_emojis(payload, emojis)
-
-                            for role in roles:
-                                if roles.index(role) == index:
-                                    add_role = get(guild.roles, name=role)
-                                    await payload.member.add_roles(add_role)
-
-                        else:
-                            channel = self.bot.get_channel(payload.channel_id)
-                            message = await channel.fetch_message(payload.message_id)
-                            user = self.bot.get_user(payload.user_id)
-                            await message.remove_reaction(str(payload.emoji), user)
+                reaction_roles = methods.get_reaction_message(payload.message_id)
+                emoji = methods.emoji_key(payload.emoji)
+
+                if reaction_roles is not None:
+                    methods.set_reaction_channel(payload.message_id, payload.channel_id)
+
+                if reaction_roles is not None and emoji in reaction_roles:
+                    role = guild.get_role(reaction_roles[emoji])
+                    if role is not None:
+                        await payload.member.add_roles(role)
+
+                elif reaction_roles is not None:
+                    channel = self.bot.get_channel(payload.channel_id)
+                    message = await channel.fetch_message(payload.message_id)
+                    user = self.bot.get_user(payload.user_id)
+                    await message.remove_reaction(str(payload.emoji), user)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload):
         """ Method event called when a reaction is removed """
-        reactions = (methods.get_reaction_roles())["reaction_messages"]
-        guild = find(lambda g: g.id == payload.guild_id, self.bot.guilds)
-        member = guild.get_member(payload.user_id)
-        for message in reactions:
-            if payload.message_id == message.get("message_id") and payload.user_id != self.bot.user.id:
-                roles = message.get("reaction_roles")
-                emojis = message.get("reaction_emojis")
-
-                if payload.emoji.name in emojis:
-                    index = index_emojis(payload, emojis)
-
-                    for role in roles:
-                        if roles.index(role) == index:
-                            remove_role = get(guild.roles, name=role)
-                            await member.remove_roles(remove_role)
+        reaction_roles = methods.get_reaction_message(payload.message_id)
+        if reaction_roles is not None and payload.user_id != self.bot.user.id:
+            guild = self.bot.get_guild(payload.guild_id)
+            member = guild.get_member(payload.user_id)
+            role = guild.get_role(reaction_roles.get(methods.emoji_key(payload.emoji)))
+
+            if member is not None and role is not None:
+                await member.remove_roles(role)
 
     @commands.Cog.listener()
     async def on_message(self, message):
         """ Method called when a message is received in a guild, has multiple uses, mainly for cleanup and anti-spam """
         if message.guild is not None:
-            msgs = message.content.split(" ")
             config = methods.get_config()
-            if not message.author.guild_permissions.administrator:
-                for word in msgs:
-                    if word in methods.get_filtered():
-                        await message.delete()
+            if not message.author.bot and not message.author.guild_permissions.administrator:
+                word_filter = methods.get_word_filter()
+                filtered = word_filter.search(message.content, config.get("filter_substrings", False)) is not None
+                invite = "https://discord.gg/" in message.content or "https://discord.com/invite/" in message.content
+                spam = self.spam_tracker.check(message, config.get("anti_spam", SpamTracker.defaults))
 
-                if ('https://discord.gg/' in message.content) or ('https://discord.com/invite/' in message.content):
+                if filtered or invite or spam is not None:
                     await message.delete()
 
-                if len(message.mentions) >= 4:
-                    await message.delete()
+                if spam == "mute":
                     role = config["muted_role"]
                     if role != "":
                         try:
                             await message.author.add_roles(get(message.author.guild.roles, name=role))
+                            await methods.add_case(message.guild.id, message.author.id, self.bot.user.id, "mute",
+                                                   "Spamming")
 
                         except AttributeError:
                             print(f"Error while trying to add '{role}' role to user, role does not exist in the guild.")
 
+                        except discord.HTTPException as error:
+                            print(f"Failed to mute {message.author} for spamming: {error}")
+
+                elif spam == "kick":
+                    try:
+                        await message.author.kick(reason="Spamming")
+                        await methods.add_case(message.guild.id, message.author.id, self.bot.user.id, "kick",
+                                               "Spamming")
+
+                    except discord.HTTPException as error:
+                        print(f"Failed to kick {message.author} for spamming: {error}")
+
             if f"<@!{self.bot.user.id}>" == message.content:
                 await message.channel.send(f"For help type: **{config['prefix']}help**")
 
             if message.content.startswith(config["prefix"]):
-                cmds = methods.get_cmds()
-                if config['prefix'] in message.content:
-                    msg = message.content.replace(f"{config['prefix']}", "")
-
-                else:
-                    msg = message.content
-
-                msg = (msg.lower().split(" "))[0]
-                bot_commands = []
-                for cog in self.bot.cogs.keys():
-                    for command in self.bot.get_cog(cog).get_commands():
-                        bot_commands.append(command.name)
+                cmds = methods.get_cmds()["commands"]
+                msg = (message.content[len(config["prefix"]):].lower().split(" "))[0]
 
                 channel_id = config["logging_channel_id"]
-                channel = self.bot.get_channel(channel_id)
                 if msg in cmds:
                     title = f"**__{msg.capitalize()}__**"
                     description = f"{cmds.get(msg)}"
                     await message.channel.send(embed=methods.return_embed(self, message, title, description,
                                                                           color="green"))
 
-                elif msg in bot_commands and channel_id is not None:
-                    embed = methods.return_embed(self, message, title="__Logged Command__", color="green")
-                    embed.add_field(name="**User**", value=message.author.mention)
-                    embed.add_field(name="**Command**", value=message.content)
-                    await channel.send(embed=embed)
+                elif self.bot.get_command(msg) is not None and channel_id is not None:
+                    self.queue_log(message)
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
         """ Cleanup method called when a channel is deleted to check if it is a ticket and remove any ticket data """
-        select = """ SELECT channel_id FROM tickets; """
-        data = methods.send_query(select)
-        tuples = list(zip(*data))
-        channel_ids = [] if tuples == [] else tuples[0]
-
-        if channel.id in channel_ids:
-            delete = f""" DELETE FROM tickets WHERE channel_id = {channel.id}; """
-            methods.send_query(delete)
-
-
-def index_emojis(payload, emojis):
-    """ Function to fetch the index of an emoji """
-    for idx, emoji in enumerate(emojis):
-        if ":" in emoji:
-            emoji_final = (emoji.split(":"))[1]
-            emojis[idx] = emoji_final
-
-    for emoji in emojis:
-        if payload.emoji.name == emoji:
-            return emojis.index(emoji)
+        await methods.remove_ticket(channel.id)
+
+
+class SpamTracker:
+    """ Anti-spam tracker that keeps a short ring buffer of recent messages per member per channel,
+        the least recently active members are dropped once max_tracked is reached so memory stays bounded """
+    defaults = {"enabled": True, "window_seconds": 8, "max_messages": 6, "max_mentions": 3, "max_attachments": 5,
+                "mute_after": 2, "kick_after": 3, "strike_reset_seconds": 600, "max_tracked": 10000}
+
+    def __init__(self):
+        """ Initialization method to create the message windows and strike counters """
+        self.windows = OrderedDict()
+        self.strikes = OrderedDict()
+
+    @staticmethod
+    def _touch(cache, key, factory, limit):
+        """ Method to get an entry and mark it as recently used, evicting the oldest entries over the limit """
+        entry = cache.get(key)
+        if entry is None:
+            entry = cache[key] = factory()
+            while len(cache) > limit:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return entry
+
+    def check(self, message, settings):
+        """ Method to record a message and return the action to take against its author,
+            None if they are within the limits, otherwise 'delete', 'mute' or 'kick', a member only escalates on
+            the message that earns them a strike so the rest of that burst is just deleted """
+        if not settings.get("enabled", True):
+            return None
+
+        settings = {**self.defaults, **settings}
+        now = time.monotonic()
+        key = (message.channel.id, message.author.id)
+        window = self._touch(self.windows, key, lambda: deque(maxlen=settings["max_messages"] + 1),
+                             settings["max_tracked"])
+        window.append((now, len(message.mentions), len(message.attachments)))
+        while window[0][0] < now - settings["window_seconds"]:
+            window.popleft()
+
+        if (len(window) <= settings["max_messages"]
+                and sum(entry[1] for entry in window) <= settings["max_mentions"]
+                and sum(entry[2] for entry in window) <= settings["max_attachments"]):
+            return None
+
+        strike = self._touch(self.strikes, message.author.id, lambda: [0, 0], settings["max_tracked"])
+        if now - strike[1] > settings["strike_reset_seconds"]:
+            strike[0] = 0
+        if now - strike[1] <= settings["window_seconds"]:
+            return "delete"
+
+        strike[0] += 1
+        strike[1] = now
+        if strike[0] >= settings["kick_after"]:
+            return "kick"
+        if strike[0] >= settings["mute_after"]:
+            return "mute"
+        return "delete"
 
 
 def setup(bot):
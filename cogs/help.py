@@ -21,7 +21,6 @@ class Help(commands.Cog):
         commands_list = f"*Use **{config['prefix']}help <command>** for help with usage.*\n" \
                         f"*Use **{config['prefix']}help 2** to view the second help page.*\n"
         commands_list_2 = f"*Use **{config['prefix']}help <command>** for help with usage.*\n"
-        bot_commands = []
         for cog in self.bot.cogs.keys():
             commands_list += f"\n**__{cog}__**\n" if cog in ("Users", "Tickets") else ""
             commands_list_2 += f"\n**__{cog}__**\n" if cog in ("Moderation", "Help") else ""
@@ -29,12 +28,12 @@ class Help(commands.Cog):
             if str(cog) != "Admin":
                 cog_commands = self.bot.get_cog(cog).get_commands()
                 for command in cog_commands:
-                    bot_commands.append(command.name)
                     commands_list += f"**{config['prefix']}{command.name}** - *{command.description}*\n" if cog in [
                         "Users", "Tickets"] else ""
                     commands_list_2 += f"**{config['prefix']}{command.name}** - *{command.description}*\n" if cog in [
                         "Moderation", "Help"] else ""
 
+        command = self.bot.get_command(arg) if arg is not None else None
         if arg is None or arg == "1":
             title = "**__Help Page: 1__**"
             description = f"**__Commands:__**\n{commands_list}"
@@ -47,7 +46,7 @@ class Help(commands.Cog):
             await ctx.author.send(embed=methods.return_embed(self, ctx, title, description, color="blue"))
             await ctx.send(embed=return_help(self, ctx))
 
-        elif arg not in bot_commands:
+        elif command is None or command.cog_name == "Admin":
             description = "Invalid command, it could be an admin command."
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
@@ -63,22 +62,20 @@ class Help(commands.Cog):
         """ Command to show the commands that require administrator permissions """
         config = methods.get_config()
         commands_list = f"*Use **{config['prefix']}adminhelp <command>** for help with usage.*\n"
-        bot_commands = []
-        for cog in self.bot.cogs.keys():
-            if str(cog) == "Admin":
-                commands_list += f"\n**__{cog}__**\n"
-                cog_commands = self.bot.get_cog(cog).get_commands()
-                for command in cog_commands:
-                    bot_commands.append(command.name)
-                    commands_list += f"**{config['prefix']}{command.name}** - *{command.description}*\n"
+        admin_cog = self.bot.get_cog("Admin")
+        if admin_cog is not None:
+            commands_list += "\n**__Admin__**\n"
+            for command in admin_cog.get_commands():
+                commands_list += f"**{config['prefix']}{command.name}** - *{command.description}*\n"
 
+        command = self.bot.get_command(arg) if arg is not None else None
         if arg is None:
             title = "**__Admin Help__**"
             description = f"**__Commands:__**\n{commands_list}"
             await ctx.author.send(embed=methods.return_embed(self, ctx, title, description, color="blue"))
             await ctx.send(embed=return_help(self, ctx))
 
-        elif arg not in bot_commands:
+        elif command is None or command.cog_name != "Admin":
             description = "Invalid command, it may not be an admin command."
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
@@ -98,14 +95,11 @@ def return_help(self, ctx):
 
 
 def fetch_commands(self, arg):
-    """ Function to fetch aliases and usage of a given command """
-    for cog in self.bot.cogs.keys():
-        cog_commands = self.bot.get_cog(cog).get_commands()
-        for command in cog_commands:
-            if command.name == arg:
-                aliases = ", ".join(command.aliases) if command.aliases != [] else "None"
-                usage = "" if command.help == "" else f"*{command.help}*"
-                return command, aliases, usage
+    """ Function to fetch aliases and usage of a given command or alias from the bot's command index """
+    command = self.bot.get_command(arg)
+    aliases = ", ".join(command.aliases) if command.aliases != [] else "None"
+    usage = "" if command.help == "" else f"*{command.help}*"
+    return command, aliases, usage
 
 
 def setup(bot):
@@ -1,7 +1,9 @@
 """ Management module to define all moderation commands seperately for easier sorting """
 import asyncio
-import json
-import random
+import datetime
+import re
+import shlex
+import time
 
 import discord
 from discord.ext import commands
@@ -19,8 +21,178 @@ class Moderation(commands.Cog):
         self.time_format = "%d/%B/%Y %H:%M:%S UTC"
         self.message_ids = []
         self.colors = {"red": 0xff5959, "green": 0x00ff40, "pink": 0xff00ff, "blue": 0x0080c0}
+        self.purge_scan_limit = 10000
+        self.unban_concurrency = 4
+        self.role_concurrency = 3
+        self.lockdown_concurrency = 10
+        self.giveaways = {}
+        self.giveaway_scheduler = methods.Scheduler(self.giveaway_timer)
+        self.punishment_scheduler = methods.Scheduler(self.expire_punishment)
+        self.bot.loop.create_task(self.start_giveaways())
+        self.bot.loop.create_task(self.start_punishments())
+        self.job_runner = methods.JobRunner(bot, {"unban": self.run_unban_job, "roles": self.run_role_job})
+        self.bot.loop.create_task(self.job_runner.resume())
         print(f"{self.__class__.__name__} cog loaded.")
 
+    def cog_unload(self):
+        """ Method called when the cog is unloaded to stop the giveaway and punishment timers and any bulk jobs,
+            all are saved in the database and picked up again when the cog is loaded """
+        self.giveaway_scheduler.stop()
+        self.punishment_scheduler.stop()
+        self.job_runner.stop()
+
+    async def start_giveaways(self):
+        """ Method to schedule the end of every running giveaway, giveaways that ended while the bot
+            was offline are due straight away """
+        await self.bot.wait_until_ready()
+        for giveaway in await methods.get_running_giveaways():
+            self.giveaways[giveaway[0]] = giveaway
+            self.giveaway_scheduler.schedule(("end", giveaway[0]), giveaway[4])
+        self.schedule_countdown()
+        self.giveaway_scheduler.start(self.bot.loop)
+
+    async def start_punishments(self):
+        """ Method to schedule the expiry of every timed mute and ban, punishments that expired while the bot
+            was offline are due straight away """
+        await self.bot.wait_until_ready()
+        for guild_id, user_id, kind, expires_at in await methods.get_punishments():
+            self.punishment_scheduler.schedule((kind, guild_id, user_id), expires_at)
+        self.punishment_scheduler.start(self.bot.loop)
+
+    async def punish_until(self, guild, user, kind, seconds):
+        """ Method to save and schedule the expiry of a timed punishment, or to clear it for a permanent one,
+            returns the expiry time """
+        if seconds is None:
+            await self.lift_punishment(guild, user, kind)
+            return None
+
+        expires_at = int(time.time()) + seconds
+        await methods.add_punishment(guild.id, user.id, kind, expires_at)
+        self.punishment_scheduler.schedule((kind, guild.id, user.id), expires_at)
+        return expires_at
+
+    async def lift_punishment(self, guild, user, kind):
+        """ Method to forget a timed punishment that was lifted by hand """
+        self.punishment_scheduler.cancel((kind, guild.id, user.id))
+        await methods.remove_punishment(guild.id, user.id, kind)
+
+    async def expire_punishment(self, key):
+        """ Method called by the punishment scheduler to unmute or unban a user, the punishment is retried five
+            minutes later if Discord refuses for any reason other than it already being lifted """
+        kind, guild_id, user_id = key
+        guild = self.bot.get_guild(guild_id)
+        try:
+            if guild is not None and kind == "mute":
+                member = guild.get_member(user_id)
+                role = get(guild.roles, name=methods.get_config()["muted_role"])
+                if member is not None and role in member.roles:
+                    await member.remove_roles(role, reason="Mute expired")
+                    await methods.add_case(guild_id, user_id, self.bot.user.id, "unmute", "Mute expired")
+
+            elif guild is not None and kind == "ban":
+                await guild.unban(discord.Object(id=user_id), reason="Ban expired")
+                await methods.add_case(guild_id, user_id, self.bot.user.id, "unban", "Ban expired")
+
+        except discord.NotFound:
+            pass
+
+        except discord.HTTPException as error:
+            print(f"Failed to lift the {kind} of {user_id}: {error}")
+            self.punishment_scheduler.schedule(key, int(time.time()) + 300)
+            return
+
+        await methods.remove_punishment(guild_id, user_id, kind)
+
+    def schedule_countdown(self):
+        """ Method to schedule the next countdown edit if edits are enabled and a giveaway is running """
+        cadence = methods.get_config().get("giveaway_countdown_seconds", 0)
+        if cadence and self.giveaways and "countdown" not in self.giveaway_scheduler.times:
+            self.giveaway_scheduler.schedule("countdown", time.time() + max(cadence, 5))
+
+    def giveaway_embed(self, ctx, giveaway, color="blue", ended=False):
+        """ Method to create a giveaway's embed, the end time is a Discord timestamp so every client
+            counts it down locally without the message being edited """
+        host_id, prize, ends_at = giveaway[2:5]
+        if ended:
+            status = "Ended."
+        else:
+            status = f"Ends <t:{ends_at}:R>"
+            if methods.get_config().get("giveaway_countdown_seconds", 0):
+                days, hours, minutes, secs = calc_time(max(0, ends_at - int(time.time())))
+                status += f" ({days}d {hours}h {minutes}m)"
+
+        title = ":partying_face: **__Giveaway__** :partying_face: "
+        winners = f"\n**Winners: {giveaway[6]}**" if giveaway[6] > 1 else ""
+        description = f"{prize}\n\n **{status}**{winners}\n\n*Started by: <@{host_id}>*"
+        return methods.return_embed(self, ctx, title, description, color=color)
+
+    async def giveaway_timer(self, key):
+        """ Method called by the giveaway scheduler, either to end a giveaway or to edit every running
+            giveaway's countdown in one pass, a giveaway that fails to end is retried five minutes later """
+        if key == "countdown":
+            try:
+                for giveaway in list(self.giveaways.values()):
+                    try:
+                        message = await methods.fetch_message(self.bot, giveaway[1], giveaway[0])
+                        if message is not None and giveaway[4] > time.time():
+                            await message.edit(embed=self.giveaway_embed(message, giveaway))
+
+                    except discord.HTTPException as error:
+                        print(f"Failed to update the countdown of giveaway {giveaway[0]}: {error}")
+
+            finally:
+                self.schedule_countdown()
+
+        else:
+            giveaway = self.giveaways.get(key[1])
+            if giveaway is not None:
+                try:
+                    await self.finish_giveaway(giveaway)
+                    del self.giveaways[key[1]]
+
+                except discord.HTTPException as error:
+                    print(f"Failed to end giveaway {key[1]}: {error}")
+                    self.giveaway_scheduler.schedule(key, int(time.time()) + 300)
+
+    async def pick_winners(self, message, count):
+        """ Method to draw winners from a giveaway's 🎉 reactions a page at a time, skipping bots, blacklisted users
+            and anyone who already won it, entries are weighted by the giveaway_role_weights config """
+        reaction = get(message.reactions, emoji="🎉")
+        if reaction is None:
+            return []
+
+        previous = await methods.get_giveaway_winners(message.id)
+        role_weights = methods.get_config().get("giveaway_role_weights", {})
+
+        def weight(user):
+            if user.bot or user.id in previous or methods.is_blacklisted(user):
+                return 0
+            weights = [role_weights[role.name] for role in getattr(user, "roles", ()) if role.name in role_weights]
+            return max(weights) if weights else 1
+
+        winners = await methods.sample_weighted(reaction.users(limit=None), count, weight)
+        await methods.add_giveaway_winners(message.id, [winner.id for winner in winners])
+        return winners
+
+    async def finish_giveaway(self, giveaway):
+        """ Method to pick the winners of a giveaway and show them on the giveaway message, winners saved by an
+            earlier attempt that failed to edit the message are announced instead of drawing again """
+        message = await methods.fetch_message(self.bot, giveaway[1], giveaway[0])
+        if message is not None:
+            winners = [f"<@{user_id}>" for user_id in await methods.get_giveaway_winners(message.id)]
+            if not winners:
+                winners = [winner.mention for winner in await self.pick_winners(message, giveaway[6])]
+            embed = self.giveaway_embed(message, giveaway, color="red", ended=True)
+            if len(winners) > 1:
+                content = f"🎉 **{', '.join(winners)} have won the giveaway of**: `{giveaway[3]}`"
+            elif winners:
+                content = f"🎉 **{winners[0]} has won the giveaway of**: `{giveaway[3]}`"
+            else:
+                content = f"🎉 **Nobody entered the giveaway of**: `{giveaway[3]}`"
+            await message.edit(content=content, embed=embed)
+
+        await methods.end_giveaway(giveaway[0])
+
     @commands.command(help="<message>", description="Embeds your messages and deletes the original.")
     @commands.guild_only()
     @has_permissions(manage_messages=True)
@@ -71,6 +243,95 @@ class Moderation(commands.Cog):
             description = f"All members in this channel with the role `{role}` have been un-muted."
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
+    async def edit_channels(self, channels, edit):
+        """ Method to await edit(channel) for every channel with at most lockdown_concurrency edits in flight,
+            returns the channels that were edited """
+        semaphore = asyncio.Semaphore(self.lockdown_concurrency)
+
+        async def run(channel):
+            async with semaphore:
+                try:
+                    await edit(channel)
+                    return channel
+
+                except discord.HTTPException as error:
+                    print(f"Failed to update the permissions of #{channel}: {error}")
+
+        return [channel for channel in await asyncio.gather(*map(run, channels)) if channel is not None]
+
+    @commands.command(help="", description="Stops @everyone from talking in every text channel, "
+                                           "unlockdown restores the channels exactly as they were.",
+                      aliases=["lockall", "serverlock"])
+    @commands.guild_only()
+    @has_permissions(manage_channels=True)
+    async def lockdown(self, ctx):
+        """ Locks every text channel, the overwrites of each channel are saved before it is changed """
+        if await methods.get_lockdown(ctx.guild.id):
+            description = f"The server is already locked down, use {methods.get_prefix()}unlockdown first."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+            return
+
+        everyone = ctx.guild.default_role
+
+        def lock_changes(channel):
+            """ Function to get the overwrites that stop @everyone and any role allowed to talk from sending """
+            changes = {}
+            for target, overwrite in channel.overwrites.items():
+                if isinstance(target, discord.Role) and target != everyone and overwrite.send_messages:
+                    overwrite.update(send_messages=False)
+                    changes[target] = overwrite
+            overwrite = channel.overwrites_for(everyone)
+            if overwrite.send_messages is not False:
+                overwrite.update(send_messages=False, add_reactions=False)
+                changes[everyone] = overwrite
+            return changes
+
+        channels = [channel for channel in ctx.guild.text_channels if lock_changes(channel)]
+        snapshots = []
+        for channel in channels:
+            overwrites = [[target.id, "role" if isinstance(target, discord.Role) else "member", *map(
+                lambda permissions: permissions.value, overwrite.pair())]
+                          for target, overwrite in channel.overwrites.items()]
+            snapshots.append((channel.id, overwrites))
+        await methods.save_lockdown(ctx.guild.id, snapshots)
+
+        async def lock(channel):
+            await channel.edit(overwrites={**channel.overwrites, **lock_changes(channel)}, reason="Lockdown")
+
+        locked = await self.edit_channels(channels, lock)
+        title = "**__Server Locked__**"
+        description = f"{len(locked)}/{len(channels)} channels have been locked."
+        await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
+
+    @commands.command(help="", description="Restores every channel locked by lockdown.",
+                      aliases=["unlockall", "serverunlock"])
+    @commands.guild_only()
+    @has_permissions(manage_channels=True)
+    async def unlockdown(self, ctx):
+        """ Restores the saved overwrites of every locked channel, snapshots are kept for channels that failed """
+        snapshots = dict(await methods.get_lockdown(ctx.guild.id))
+        if not snapshots:
+            await ctx.send(embed=methods.return_error(self, ctx, error="The server isn't locked down."))
+            return
+
+        async def restore(channel):
+            overwrites = {}
+            for target_id, kind, allow, deny in snapshots[channel.id]:
+                target = ctx.guild.get_role(target_id) if kind == "role" else ctx.guild.get_member(target_id)
+                if target is not None:
+                    overwrites[target] = discord.PermissionOverwrite.from_pair(discord.Permissions(allow),
+                                                                               discord.Permissions(deny))
+            await channel.edit(overwrites=overwrites, reason="Lockdown lifted")
+
+        channels = [channel for channel in map(ctx.guild.get_channel, snapshots) if channel is not None]
+        restored = await self.edit_channels(channels, restore)
+        deleted = [channel_id for channel_id in snapshots if ctx.guild.get_channel(channel_id) is None]
+        await methods.remove_lockdown(ctx.guild.id, [channel.id for channel in restored] + deleted)
+
+        title = "**__Server Unlocked__**"
+        description = f"{len(restored)}/{len(channels)} channels have been restored."
+        await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
+
     @commands.command(help="<seconds>",
                       description="Enables slow-mode with a time between messages, enter '0' or 'off' to turn it off.")
     @commands.guild_only()
@@ -101,21 +362,35 @@ class Moderation(commands.Cog):
     async def kick(self, ctx, member: discord.Member, *, reason=None):
         """ Kicks a user .kick @Pat """
         await member.kick(reason=reason)
+        await methods.add_case(ctx.guild.id, member.id, ctx.author.id, "kick", reason)
         title = "__User Kicked__"
         description = f"{member.mention} was kicked by {ctx.message.author.mention}"
         await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
-    @commands.command(help="<@user> <reason> (Reason is not required.)",
-                      description="Bans a user from the discord server.")
+    @commands.command(help="<@user> [duration] <reason> (Duration and reason are not required.)\n\n"
+                           "e.g: 7d spamming bans for 7 days.",
+                      description="Bans a user from the discord server, for a while if a duration is given.")
     @commands.guild_only()
     @has_permissions(ban_members=True)
     async def ban(self, ctx, member: discord.Member, *, reason=None):
-        """ Bans a user .ban @Pat """
+        """ Bans a user .ban @Pat, .ban @Pat 7d spam bans them for 7 days """
+        seconds = None
+        if reason is not None and methods.parse_duration(reason.split(maxsplit=1)[0]) is not None:
+            duration, *reason = reason.split(maxsplit=1)
+            seconds = methods.parse_duration(duration)
+            reason = reason[0] if reason else None
+
         banned_users = await ctx.guild.bans()
         if member not in banned_users:
             await member.ban(reason=reason)
+            expires_at = await self.punish_until(ctx.guild, member, "ban", seconds)
+            if expires_at is not None:
+                reason = f"{reason} (for {duration})" if reason is not None else f"For {duration}"
+            await methods.add_case(ctx.guild.id, member.id, ctx.author.id, "ban", reason)
             title = "__User Banned__"
             description = f"{member.mention} was banned by {ctx.message.author.mention}"
+            if expires_at is not None:
+                description += f" until <t:{expires_at}:f>"
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
         else:
             await ctx.send(embed=methods.return_error(self, ctx, error=f"{member.mention} is already banned."))
@@ -136,6 +411,8 @@ class Moderation(commands.Cog):
 
         elif (user.name, user.discriminator) == (member_name, member_discriminator):
             await ctx.guild.unban(user)
+            await self.lift_punishment(ctx.guild, user, "ban")
+            await methods.add_case(ctx.guild.id, user.id, ctx.author.id, "unban")
             title = "__User Unbanned__"
             description = f"{member} was unbanned by {ctx.message.author.mention}"
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
@@ -170,16 +447,107 @@ class Moderation(commands.Cog):
             description = f"{member.mention} does not have role {role}"
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-    @commands.command(help="<@user>", description="Gives the user the Muted role.")
+    @staticmethod
+    def role_targets(guild, options):
+        """ Method to get the members a bulk role job still has to change, members that already have
+            (or don't have) the role are left out so they cost no requests """
+        role = guild.get_role(options["role_id"])
+        target = options["target"]
+        adding = options["method"] == "add"
+        if role is None:
+            return None, []
+
+        if target == "humans":
+            members = (member for member in guild.members if not member.bot)
+        elif target == "bots":
+            members = (member for member in guild.members if member.bot)
+        elif target == "all":
+            members = guild.members
+        else:
+            target_role = guild.get_role(target)
+            members = target_role.members if target_role is not None else []
+        return role, [member for member in members if (role in member.roles) != adding]
+
+    async def run_role_job(self, guild, message, job_id, options, done=0, failed=0, skip=()):
+        """ Method to add or remove a role for every targeted member, one request per member that needs it """
+        role, members = self.role_targets(guild, options)
+        adding = options["method"] == "add"
+        items = [(member.id, member) for member in members if member.id not in skip]
+
+        async def action(member):
+            if adding:
+                await member.add_roles(role, reason="Bulk role")
+            else:
+                await member.remove_roles(role, reason="Bulk role")
+
+        action_name = "members given the role" if adding else "members removed from the role"
+        progress = methods.job_progress(self, "__Bulk Role__", message, action_name)
+        job = methods.BulkJob(job_id, items, action, concurrency=self.role_concurrency, progress=progress,
+                              done=done, failed=failed)
+        await job.run()
+
+    @commands.command(help="<add/remove> <role> [all/humans/bots/role] [dryrun]\n\n"
+                           "e.g: roleall add Member humans, roleall remove Trial @Staff dryrun",
+                      description="Adds or removes a role for every member, every human, every bot or every member "
+                                  "of another role.", aliases=["massrole", "bulkrole"])
     @commands.guild_only()
     @has_permissions(manage_roles=True)
-    async def mute(self, ctx, member: discord.Member):
-        """ Adds the 'Muted' role to the user but only if there is a muted role, e.g: .mute @Jam """
+    async def roleall(self, ctx, method=None, role: discord.Role = None, target="all", option=None):
+        """ Bulk role command, the changes run in the background, skip members that already match
+            and resume after a restart """
+        dry_run = "dryrun" in (target, option)
+        target = "all" if target == "dryrun" else target
+        if target not in ("all", "humans", "bots"):
+            try:
+                target = (await commands.RoleConverter().convert(ctx, target)).id
+
+            except commands.BadArgument:
+                target = None
+
+        if method not in ("add", "remove"):
+            description = "No type was given, please choose from 'add' or 'remove'."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+
+        elif role is None or target is None:
+            await ctx.send(embed=methods.return_error(self, ctx, error="Invalid Role"))
+
+        elif role >= ctx.guild.me.top_role or role.managed or role.is_default():
+            description = f"{role.mention} can't be given or removed by the bot."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+
+        else:
+            options = {"method": method, "role_id": role.id, "target": target}
+            _, members = self.role_targets(ctx.guild, options)
+            title = "__Bulk Role__"
+            if dry_run:
+                change = "given" if method == "add" else "removed from"
+                description = f"{len(members)} members would be {change} {role.mention}."
+                await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="blue"))
+
+            else:
+                description = f"Starting to update {len(members)} members..."
+                message = await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="pink"))
+                job_id = await methods.create_job("roles", ctx.guild.id, ctx.channel.id, message.id, options)
+                self.job_runner.start(self.run_role_job(ctx.guild, message, job_id, options))
+
+    @commands.command(help="<@user> [duration] (e.g: 2h, 1d or 1h30m, leave empty to mute until unmuted)",
+                      description="Gives the user the Muted role, for a while if a duration is given.")
+    @commands.guild_only()
+    @has_permissions(manage_roles=True)
+    async def mute(self, ctx, member: discord.Member, duration=None):
+        """ Adds the 'Muted' role to the user but only if there is a muted role, e.g: .mute @Jam 2h, muting someone
+            who is already muted for a while changes when it ends or, without a duration, makes it permanent """
         config = methods.get_config()
         muted_role = config["muted_role"]
         role = get(member.guild.roles, name=muted_role)
+        seconds = methods.parse_duration(duration) if duration is not None else None
 
-        if role is None:
+        if duration is not None and seconds is None:
+            description = f"Invalid duration. Please use days (d), hours (h), minutes (m) or seconds (s).\n " \
+                          f"e.g: {config['prefix']}mute @user 2h"
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+
+        elif role is None:
             description = "No `Muted` role has been set in the config."
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
@@ -187,10 +555,17 @@ class Moderation(commands.Cog):
             description = f"**The role `{role}` does not exist.**"
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-        elif role not in member.roles:
-            await member.add_roles(role)
+        elif (role not in member.roles or seconds is not None
+              or ("mute", ctx.guild.id, member.id) in self.punishment_scheduler.times):
+            if role not in member.roles:
+                await member.add_roles(role)
+            expires_at = await self.punish_until(ctx.guild, member, "mute", seconds)
+            await methods.add_case(ctx.guild.id, member.id, ctx.author.id, "mute",
+                                   None if expires_at is None else f"For {duration}")
             title = "**__User Muted__**"
             description = f"{member.mention} was muted by {ctx.message.author.mention}"
+            if expires_at is not None:
+                description += f" until <t:{expires_at}:f>"
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
         elif role in member.roles:
@@ -216,6 +591,8 @@ class Moderation(commands.Cog):
 
         elif role in member.roles:
             await member.remove_roles(role)
+            await self.lift_punishment(ctx.guild, member, "mute")
+            await methods.add_case(ctx.guild.id, member.id, ctx.author.id, "unmute")
             title = "**__User Un-muted__**"
             description = f"{member.mention} was un-muted by {ctx.message.author.mention}"
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
@@ -224,37 +601,149 @@ class Moderation(commands.Cog):
             description = f"{member.mention} is not muted."
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-    @commands.command(help="<amount>", description="Clears an amount of recent messages from the channel's history.",
+    async def purge_messages(self, channel, amount, check, first=None, before=None, after=None):
+        """ Method to delete up to amount messages passing check, newest first, history is read lazily and the
+            matches are deleted in bulk batches of 100, only messages too old for a bulk delete are deleted one by
+            one, returns the deleted, skipped and failed counts """
+        deleted, skipped, failed = 0, 0, 0
+        batch = [first] if first is not None else []
+        bulk_cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=14) + datetime.timedelta(minutes=1)
+
+        async def delete_batch():
+            nonlocal deleted, failed
+            try:
+                await channel.delete_messages(batch)
+                deleted += len(batch)
+
+            except discord.HTTPException as error:
+                failed += len(batch)
+                print(f"Failed to bulk delete messages: {error}")
+            batch.clear()
+
+        history = channel.history(limit=self.purge_scan_limit, before=before or first, after=after,
+                                  oldest_first=False)
+        async for message in history:
+            if deleted + failed + len(batch) - (first is not None) >= amount:
+                break
+
+            if not check(message):
+                skipped += 1
+
+            elif message.created_at > bulk_cutoff:
+                batch.append(message)
+                if len(batch) == 100:
+                    await delete_batch()
+
+            else:
+                try:
+                    await message.delete()
+                    deleted += 1
+
+                except discord.HTTPException:
+                    failed += 1
+
+        if batch:
+            await delete_batch()
+        return deleted - (first is not None), skipped, failed
+
+    @commands.command(help="<amount> [@user] [bots] [links] [attachments] [contains:text] [regex:pattern] "
+                           "[after:time] [before:time]\n\nTimes can be a date (YYYY-MM-DD) or a duration ago (2h).",
+                      description="Clears an amount of recent messages from the channel's history.",
                       aliases=['clear'])
     @commands.guild_only()
     @has_permissions(manage_messages=True)
-    async def purge(self, ctx, amount=10):
-        """ Clears messages from chat: e.g .clear 100 """
-        await ctx.channel.purge(limit=amount)
+    async def purge(self, ctx, amount: int = 10, *, filters=""):
+        """ Clears messages from chat, optionally only the ones matching every filter: e.g .clear 100 @Pat links """
+        checks, times, target_id = [], {}, None
+        try:
+            for word in shlex.split(filters):
+                key, _, value = word.partition(":")
+                mention = re.fullmatch(r"<@!?(\d+)>", word)
+                if mention is not None:
+                    user_id = target_id = int(mention.group(1))
+                    checks.append(lambda message, user_id=user_id: message.author.id == user_id)
+                elif word == "bots":
+                    checks.append(lambda message: message.author.bot)
+                elif word == "links":
+                    checks.append(lambda message: re.search(r"https?://", message.content) is not None)
+                elif word in ("attachments", "files"):
+                    checks.append(lambda message: bool(message.attachments))
+                elif key == "contains" and value:
+                    checks.append(lambda message, text=value.lower(): text in message.content.lower())
+                elif key == "regex" and value:
+                    checks.append(lambda message, pattern=re.compile(value): pattern.search(message.content))
+                elif key in ("after", "before") and value:
+                    seconds = methods.parse_duration(value)
+                    if seconds is not None:
+                        times[key] = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+                    else:
+                        times[key] = datetime.datetime.strptime(value, "%Y-%m-%d")
+                else:
+                    raise ValueError(f"Unknown filter `{word}`.")
+
+        except (ValueError, re.error) as error:
+            await ctx.send(embed=methods.return_error(self, ctx, error=f"Invalid filter: {error}"))
+            return
+
+        deleted, skipped, failed = await self.purge_messages(
+            ctx.channel, amount, lambda message: all(check(message) for check in checks), first=ctx.message,
+            before=times.get("before"), after=times.get("after"))
+        await methods.add_case(ctx.guild.id, target_id, ctx.author.id, "purge",
+                               f"{deleted} messages in #{ctx.channel}")
+
         title = "**__Clear__**"
-        description = f'Cleared {amount} messages'
+        description = f"Cleared {deleted} messages"
+        if checks or failed:
+            description += f", {skipped} didn't match the filters and {failed} couldn't be deleted"
         message = await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
         await asyncio.sleep(2)
         await message.delete()
 
-    @commands.command(help="", description="Unbans all the banned users from the discord server.")
+    async def run_unban_job(self, guild, message, job_id, options, done=0, failed=0, skip=()):
+        """ Method to unban every banned user matching the job's filters, banned accounts can be filtered by
+            ban reason and by how old the account is """
+        now = datetime.datetime.utcnow()
+
+        def matches(entry):
+            age = (now - entry.user.created_at).total_seconds()
+            return (options.get("reason", "") in (entry.reason or "").lower()
+                    and age <= options.get("newer", age) and age >= options.get("older", age))
+
+        items = [(entry.user.id, entry.user) for entry in await guild.bans()
+                 if entry.user.id not in skip and matches(entry)]
+        progress = methods.job_progress(self, "__Unban All__", message, "users unbanned")
+
+        async def unban(user):
+            await guild.unban(user, reason="Unban all")
+            await methods.add_case(guild.id, user.id, options.get("moderator_id"), "unban", "Unban all")
+
+        job = methods.BulkJob(job_id, items, unban, concurrency=self.unban_concurrency, progress=progress,
+                              done=done, failed=failed)
+        await job.run()
+
+    @commands.command(help="[reason:text] [newer:time] [older:time]\n\nnewer and older filter by how long ago the "
+                           "banned account was created, e.g: unbanall newer:7d",
+                      description="Unbans all the banned users from the discord server.")
     @commands.guild_only()
     @has_permissions(manage_guild=True)
-    async def unbanall(self, ctx):
-        """ Command to unban all users from the guild """
-        banned_users = await ctx.guild.bans()
+    async def unbanall(self, ctx, *, filters=""):
+        """ Command to unban all users from the guild, the unbans run in the background and resume after a restart """
+        options = {"moderator_id": ctx.author.id}
+        for word in shlex.split(filters):
+            key, _, value = word.partition(":")
+            if key == "reason" and value:
+                options["reason"] = value.lower()
+            elif key in ("newer", "older") and methods.parse_duration(value) is not None:
+                options[key] = methods.parse_duration(value)
+            else:
+                await ctx.send(embed=methods.return_error(self, ctx, error=f"Invalid filter: `{word}`"))
+                return
+
         title = "__Unban All__"
         description = "Starting to unban users..."
         message = await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="pink"))
-        users = []
-
-        for ban_entry in banned_users:
-            user = ban_entry.user
-            users.append(user)
-            await ctx.guild.unban(user)
-
-        description = f"{len(users)} users have been unbanned."
-        await message.edit(embed=methods.return_embed(self, ctx, title, description, color="green"))
+        job_id = await methods.create_job("unban", ctx.guild.id, ctx.channel.id, message.id, options)
+        self.job_runner.start(self.run_unban_job(ctx.guild, message, job_id, options))
 
     @commands.command(help="<role/role> <emoji/emoji>\ne.g reactionroles Member/Trusted :clap:/:eyes:",
                       description=("Creates a message where the reactions give roles, "
@@ -264,7 +753,6 @@ class Moderation(commands.Cog):
     async def reactionroles(self, ctx, roles=None, emojis=None):
         """ Command to create an embed with reactions that saves the data to a config:
             for the events to add specific roles on reactions """
-        reaction_roles = methods.get_reaction_roles()
         role_to_check = None
         try:
             roles = roles.split("/")
@@ -313,14 +801,7 @@ class Moderation(commands.Cog):
                     for final_reaction in emojis:
                         await message.add_reaction(final_reaction)
 
-                    reaction_roles["reaction_messages"].append({
-                        "message_id": message.id,
-                        "reaction_emojis": emojis,
-                        "reaction_roles": roles
-                    })
-
-                    with open("data/reaction_roles.json", "w", encoding="UTF-8") as i:
-                        json.dump(reaction_roles, i, indent=4, ensure_ascii=False)
+                    methods.add_reaction_message(message, emojis, [get(ctx.guild.roles, name=role) for role in roles])
                     await ctx.message.delete()
                     break
 
@@ -378,85 +859,50 @@ class Moderation(commands.Cog):
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
     @commands.command(
-        help="<time> <description>\n\n (Make sure the giveaway channel id is set in the config)",
-        description="Staff command to start a giveaway in the giveaways channel. e.g: giveaway 1d Highest Rank")
+        help="<time> [winners]w <description>\n\n (Make sure the giveaway channel id is set in the config)",
+        description="Staff command to start a giveaway in the giveaways channel. e.g: giveaway 1d 3w Highest Rank")
     @has_permissions(manage_messages=True)
     async def giveaway(self, ctx, timer, *, message=None):
-        """ Staff command to start a giveaway """
+        """ Staff command to start a giveaway, the giveaway is saved and ended by the giveaway scheduler """
         config = methods.get_config()
         channel_id = config["giveaways_channel_id"]
-        if channel_id is None:
+        seconds = methods.parse_duration(timer)
+        channel = self.bot.get_channel(channel_id) if channel_id is not None else None
+        winner_count = 1
+        if message is not None and re.match(r"\d+w\s", message) is not None:
+            count, message = message.split(maxsplit=1)
+            winner_count = max(1, int(count[:-1]))
+
+        if channel is None:
             description = "Please enter your 'giveaways' channel ID into the config file."
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-        else:
-            if "d" in timer:
-                timer = timer.replace("d", "")
-                timer = int(timer)
-                timer *= 86400
+        elif message is None:
+            await ctx.send(embed=methods.return_error(self, ctx, error="No giveaway description was given."))
 
-            elif "h" in timer:
-                timer = timer.replace("h", "")
-                timer = int(timer)
-                timer *= 3600
-
-            elif "m" in timer:
-                timer = timer.replace("m", "")
-                timer = int(timer)
-                timer *= 60
-
-            else:
-                description = f"Invalid time format. Please choose either days (d), hours (h) or minutes (m).\n " \
-                              f"e.g: {config['prefix']}giveaway 5h Top Rank!"
-                await ctx.send(embed=methods.return_error(self, ctx, error=description))
+        elif seconds is None:
+            description = f"Invalid time format. Please use days (d), hours (h), minutes (m) or seconds (s).\n " \
+                          f"e.g: {config['prefix']}giveaway 5h Top Rank!"
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-            days, hours, minutes, secs = calc_time(timer)
-            channel = self.bot.get_channel(channel_id)
-            title = ":partying_face: **__Giveaway__** :partying_face: "
-            description = f"{message}\n\n **Ends in: {days}d {hours}h {minutes}m {secs}s.**\n\n" \
-                          f"*Started by: {ctx.message.author.mention}*"
-            giveaway = await channel.send(embed=methods.return_embed(self, ctx, title, description, color="blue"))
-            await giveaway.add_reaction("🎉")
+        else:
+            ends_at = int(time.time()) + seconds
+            giveaway = (None, channel.id, ctx.author.id, message, ends_at, 0, winner_count)
+            sent = await channel.send(embed=self.giveaway_embed(ctx, giveaway))
+            await sent.add_reaction("🎉")
             await ctx.message.delete()
 
-            while timer > 0:
-                if timer > 60:
-                    await asyncio.sleep(60)
-                    timer -= 60
-                    days, hours, minutes, secs = calc_time(timer)
-                    title = ":partying_face: **__Giveaway__** :partying_face: "
-                    description = f"{message}\n\n **Ends in: {days}d {hours}h {minutes}m.**\n\n" \
-                                  f"*Started by: {ctx.message.author.mention}*"
-                    await giveaway.edit(embed=methods.return_embed(self, ctx, title, description, color="blue"))
+            giveaway = (sent.id, *giveaway[1:])
+            await methods.add_giveaway(*giveaway[:5], winner_count)
+            self.giveaways[sent.id] = giveaway
+            self.giveaway_scheduler.schedule(("end", sent.id), ends_at)
+            self.schedule_countdown()
 
-                else:
-                    if timer <= 60:
-                        await asyncio.sleep(1)
-                        timer -= 1
-                        days, hours, minutes, secs = calc_time(timer)
-                        title = ":partying_face: **__Giveaway__** :partying_face: "
-                        description = f"{message}\n\n **Ends in: {days}d {hours}h {minutes}m {secs}s.**\n\n" \
-                                      f"*Started by: {ctx.message.author.mention}*"
-                        await giveaway.edit(embed=methods.return_embed(self, ctx, title, description, color="blue"))
-
-            if timer == 0:
-                msg = await giveaway.channel.fetch_message(giveaway.id)
-                for reaction in msg.reactions:
-                    if reaction.emoji == "🎉":
-                        members = await reaction.users().flatten()
-                        member = random.choice(members)
-                        member = self.bot.get_user(member.id)
-
-                        title = ":partying_face: **__Giveaway__** :partying_face: "
-                        description = f"{message}\n\n **Ended.**\n\n*Started by: {ctx.message.author.mention}*"
-                        await giveaway.edit(embed=methods.return_embed(self, ctx, title, description, color="red"))
-                        await giveaway.edit(content=f"🎉 **{member.mention} has won the giveaway of**: `{message}`")
-
-    @commands.command(help="<message id>", description="Selects a different user to win the giveaway.")
+    @commands.command(help="<message id> [winners]", description="Selects a different user to win the giveaway.")
     @commands.guild_only()
     @has_permissions(manage_messages=True)
-    async def reroll(self, ctx, message_id=None):
-        """ Staff command to re-roll the latest giveaway """
+    async def reroll(self, ctx, message_id: int = None, count: int = 1):
+        """ Staff command to re-roll a giveaway, nobody who has already won it can be picked again """
         config = methods.get_config()
         channel_id = config["giveaways_channel_id"]
         if message_id is None:
@@ -466,14 +912,18 @@ class Moderation(commands.Cog):
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
         else:
             await ctx.message.delete()
-            message = await ctx.fetch_message(message_id)
-            for reaction in message.reactions:
-                if reaction.emoji == "🎉":
-                    members = await reaction.users().flatten()
-                    member = random.choice(members)
-                    member = self.bot.get_user(member.id)
-                    msg = message.content.split(":")
-                    await message.edit(content=f"🎉 **{member.mention} has won the giveaway re-roll of**:{msg[1]}")
+            giveaway = await methods.get_giveaway(message_id)
+            channel = self.bot.get_channel(giveaway[1]) if giveaway is not None else ctx.channel
+            message = await channel.fetch_message(message_id)
+            prize = f" `{giveaway[3]}`" if giveaway is not None else message.content.partition(":")[2]
+            winners = await self.pick_winners(message, max(1, count))
+            if winners:
+                mentions = ", ".join(winner.mention for winner in winners)
+                await message.edit(content=f"🎉 **{mentions} {'have' if len(winners) > 1 else 'has'} "
+                                           f"won the giveaway re-roll of**:{prize}")
+            else:
+                description = "There is nobody left to win this giveaway."
+                await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
 
 def calc_time(seconds):
@@ -1,7 +1,12 @@
 """ Tickets cog that defines all the ticket commands """
-import os
+import asyncio
+import datetime
+import io
+import re
+import sqlite3
+import tempfile
+import time
 
-import aiohttp
 import discord
 from discord.ext import commands
 from discord.ext.commands import has_permissions
@@ -9,15 +14,6 @@ from discord.utils import get
 import methods
 
 
-def get_channel_id():
-    """ Function to fetch the channel_id column from the tickets table. """
-    select = """ SELECT channel_id FROM tickets; """
-    data = methods.send_query(select)
-    tuples = list(zip(*data))
-    channel_ids = [] if tuples == [] else tuples[0]
-    return channel_ids
-
-
 class Tickets(commands.Cog):
     """ Main Ticket class to setup attributes and methods to be called on each event """
 
@@ -26,8 +22,86 @@ class Tickets(commands.Cog):
         self.bot = bot
         self.time_format = "%d/%B/%Y %H:%M:%S UTC"
         self.colors = {"red": 0xff5959, "green": 0x00ff40, "pink": 0xff00ff, "blue": 0x0080c0}
+        self.transcript_memory_limit = 1024 * 1024
+        self.overwrite_concurrency = 5
+        self.sweep_defaults = {"enabled": True, "warn_after_hours": 48, "close_after_hours": 24}
+        self.ticket_warnings = {}
+        self.sweeper = methods.Scheduler(self.sweep_ticket)
+        self.bot.loop.create_task(self.start_sweeper())
         print(f"{self.__class__.__name__} cog loaded.")
 
+    def cog_unload(self):
+        """ Method called when the cog is unloaded to stop the inactive ticket sweeper """
+        self.sweeper.stop()
+
+    def sweep_settings(self):
+        """ Method to get the inactive ticket settings from the config, filled in with the defaults """
+        return {**self.sweep_defaults, **methods.get_config().get("ticket_inactivity", {})}
+
+    @staticmethod
+    def last_activity(channel):
+        """ Method to get the unix time of a channel's last message from its cached last_message_id,
+            or the channel's creation time if nothing has been sent """
+        created = discord.utils.snowflake_time(channel.last_message_id or channel.id)
+        return created.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    async def start_sweeper(self):
+        """ Method to schedule every open ticket for its inactivity check and start the sweeper, tickets that were
+            warned before a restart and are still quiet keep the close time of their warning """
+        await self.bot.wait_until_ready()
+        settings = self.sweep_settings()
+        if settings["enabled"]:
+            self.ticket_warnings = await methods.get_ticket_warnings()
+            for channel_id in await methods.get_ticket_channels():
+                channel = self.bot.get_channel(channel_id)
+                if channel is None:
+                    continue
+
+                warned = channel.last_message_id is not None and channel.last_message_id == self.ticket_warnings.get(
+                    channel_id)
+                hours = settings["close_after_hours"] if warned else settings["warn_after_hours"]
+                self.sweeper.schedule(channel_id, self.last_activity(channel) + hours * 3600)
+            self.sweeper.start(self.bot.loop)
+
+    @commands.Cog.listener()
+    async def on_ticket_open(self, channel):
+        """ Event method called when a ticket channel is created, schedules its first inactivity check """
+        self.sweeper.schedule(channel.id, time.time() + self.sweep_settings()["warn_after_hours"] * 3600)
+
+    async def sweep_ticket(self, channel_id):
+        """ Method called by the sweeper when a ticket may have gone inactive, a ticket with newer activity is
+            rescheduled from its last message, otherwise the owner is warned and the ticket is closed if nobody
+            has spoken since the warning, the check is retried five minutes later if Discord refuses """
+        settings = self.sweep_settings()
+        channel = self.bot.get_channel(channel_id)
+        warning = self.ticket_warnings.get(channel_id)
+        if channel is None or not settings["enabled"] or not await methods.is_ticket_channel(channel_id):
+            self.ticket_warnings.pop(channel_id, None)
+            return
+
+        last_activity = self.last_activity(channel)
+        try:
+            if warning is not None and channel.last_message_id == warning:
+                await self.close_ticket(channel, self.bot.user, "No activity.")
+                self.ticket_warnings.pop(channel_id, None)
+
+            elif time.time() - last_activity >= settings["warn_after_hours"] * 3600:
+                ticket = await methods.get_ticket_by_channel(channel_id)
+                message = await channel.send(f"<@{ticket[1]}> This ticket has been inactive and will be closed in "
+                                             f"{settings['close_after_hours']} hours unless a new message is sent.")
+                self.ticket_warnings[channel_id] = message.id
+                await methods.set_ticket_warning(channel_id, message.id)
+                self.sweeper.schedule(channel_id, time.time() + settings["close_after_hours"] * 3600)
+
+            else:
+                if self.ticket_warnings.pop(channel_id, None) is not None:
+                    await methods.set_ticket_warning(channel_id, None)
+                self.sweeper.schedule(channel_id, last_activity + settings["warn_after_hours"] * 3600)
+
+        except discord.HTTPException as error:
+            print(f"Failed to check the inactive ticket {channel}: {error}")
+            self.sweeper.schedule(channel_id, time.time() + 300)
+
     @commands.command(help="",
                       description="Creates a ticket to ask for support, users may only open 1 ticket at a time.",
                       aliases=["new", "createticket"])
@@ -35,31 +109,28 @@ class Tickets(commands.Cog):
     async def ticket(self, ctx):
         """ Creates a ticket channel in the ticket category and mentions the user
             (MAKE SURE THERE IS A TICKET CATEGORY) """
-        select = """ SELECT ticket_id, user_id FROM tickets; """
-        data = methods.send_query(select)
-        tuples = list(zip(*data))
-        tickets = [] if tuples == [] else tuples[0]
-        user_ids = [] if tuples == [] else tuples[1]
-        ticket_number = int(max(tickets)) if tickets != [] else 1000
-        category_check = get(ctx.guild.categories, name="tickets")
-
-        if ctx.author.id in user_ids:
-            description = "You already have a ticket open, this ticket must be closed before you can open another."
-            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+        category = get(ctx.guild.categories, name="tickets")
 
-        elif category_check not in ctx.guild.categories:
+        if category is None:
             description = """There is no category named 'tickets' for the channel to be created, 
                             please create one and set your permissions correctly."""
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
+            return
 
-        elif ctx.author.id not in user_ids and (ticket_number + 1) not in tickets:
-            ticket_number += 1
-            ticket_channel = f"ticket-{ticket_number}"
+        ticket_number = await methods.reserve_ticket(ctx.author.id)
+        if ticket_number is None:
+            description = "You already have a ticket open, this ticket must be closed before you can open another."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-            category = get(ctx.guild.categories, name="tickets")
+        else:
+            try:
+                channel = await ctx.guild.create_text_channel(f"ticket-{ticket_number}", category=category)
+                await methods.add_ticket(ticket_number, ctx.author.id, channel.id)
+                self.bot.dispatch("ticket_open", channel)
+
+            finally:
+                methods.release_ticket(ctx.author.id)
 
-            ticket = await ctx.message.guild.create_text_channel(ticket_channel, category=category)
-            channel = self.bot.get_channel(ticket.id)
             overwrite = discord.PermissionOverwrite()
             overwrite.update(read_messages=True, read_message_history=True, send_messages=True)
             await channel.set_permissions(ctx.author, overwrite=overwrite)
@@ -72,9 +143,15 @@ class Tickets(commands.Cog):
             description = "**A ticket channel has been created for you.**"
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
-            insert = f""" INSERT INTO tickets(ticket_id, user_id, channel_id)             
-                        VALUES({ticket_number}, {ctx.author.id}, {channel.id}) """
-            methods.send_query(insert)
+    @staticmethod
+    async def update_overwrites(channel, changes):
+        """ Method to apply {role or member: overwrite} changes to a channel, a single target is updated on its own
+            so it can't undo a concurrent change to another target, several are merged into one channel edit """
+        if len(changes) == 1:
+            (target, overwrite), = changes.items()
+            await channel.set_permissions(target, overwrite=overwrite)
+        else:
+            await channel.edit(overwrites={**channel.overwrites, **changes})
 
     @commands.command(help="<@user>", description="Adds a user to the ticket.", aliases=["add", "ticket_add", "tadd"])
     @commands.guild_only()
@@ -85,13 +162,10 @@ class Tickets(commands.Cog):
             await ctx.send(embed=methods.return_error(self, ctx, error="No user given"))
 
         else:
-            channel_ids = get_channel_id()
-
-            if ctx.channel.id in channel_ids:
-                channel = self.bot.get_channel(ctx.channel.id)
-                overwrite = discord.PermissionOverwrite()
-                overwrite.update(read_messages=True, read_message_history=True, send_messages=True)
-                await channel.set_permissions(user, overwrite=overwrite)
+            if await methods.is_ticket_channel(ctx.channel.id):
+                overwrite = discord.PermissionOverwrite(read_messages=True, read_message_history=True,
+                                                        send_messages=True)
+                await self.update_overwrites(ctx.channel, {user: overwrite})
                 title = "__Success__"
                 description = f"Added {user.mention} to ticket."
                 await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
@@ -109,13 +183,10 @@ class Tickets(commands.Cog):
             await ctx.send(embed=methods.return_error(self, ctx, error="No user given."))
 
         else:
-            channel_ids = get_channel_id()
-
-            if ctx.channel.id in channel_ids:
-                channel = self.bot.get_channel(ctx.channel.id)
-                overwrite = discord.PermissionOverwrite()
-                overwrite.update(read_messages=False, read_message_history=False, send_messages=False)
-                await channel.set_permissions(user, overwrite=overwrite)
+            if await methods.is_ticket_channel(ctx.channel.id):
+                overwrite = discord.PermissionOverwrite(read_messages=False, read_message_history=False,
+                                                        send_messages=False)
+                await self.update_overwrites(ctx.channel, {user: overwrite})
 
                 title = "__Success__"
                 description = f"Removed {user.mention} from the ticket."
@@ -124,59 +195,134 @@ class Tickets(commands.Cog):
             else:
                 await ctx.send(embed=methods.return_error(self, ctx, error="This channel is not a ticket."))
 
+    def format_message(self, message):
+        """ Method to turn a message into its transcript lines, with its attachments, embeds and last edit """
+        timestamp = message.created_at.strftime(self.time_format)
+        content = message.content.replace("\n", "\n    ")
+        line = f"[{timestamp}] {message.author} ({message.author.id}): {content}"
+        if message.edited_at is not None:
+            line += f" (edited {message.edited_at.strftime(self.time_format)})"
+
+        lines = [line]
+        for attachment in message.attachments:
+            lines.append(f"    Attachment: {attachment.filename} {attachment.url}")
+        for embed in message.embeds:
+            parts = (embed.title, embed.description, *(f"{field.name}: {field.value}" for field in embed.fields))
+            text = " | ".join(str(part) for part in parts if part)
+            lines.append(f"    Embed: {text}".replace("\n", "\n    "))
+        return "\n".join(lines) + "\n"
+
+    async def export_transcript(self, channel):
+        """ Method to write the full history of a channel to a transcript file, oldest message first,
+            the file is kept in memory until it passes transcript_memory_limit and then moved to a temporary file """
+        transcript = io.BytesIO()
+        async for message in channel.history(limit=None, oldest_first=True):
+            transcript.write(self.format_message(message).encode("utf-8"))
+            if isinstance(transcript, io.BytesIO) and transcript.tell() > self.transcript_memory_limit:
+                spilled = tempfile.TemporaryFile()
+                spilled.write(transcript.getbuffer())
+                transcript = spilled
+
+        transcript.seek(0)
+        return transcript
+
+    async def close_ticket(self, channel, closed_by, reason=None):
+        """ Method to close a ticket, sends the ticket owner the transcript and deletes the channel,
+            returns False if the channel isn't a ticket """
+        ticket = await methods.get_ticket_by_channel(channel.id)
+        if ticket is None:
+            return False
+
+        await channel.send(f"Ticket Closed by {closed_by}\nReason: {reason}")
+        transcript = await self.export_transcript(channel)
+        member = self.bot.get_user(ticket[1])
+        try:
+            await methods.archive_transcript(channel.guild.id, ticket[0], ticket[1], closed_by.id, channel.name,
+                                             transcript)
+
+        except sqlite3.Error as error:
+            print(f"Failed to archive the transcript of {channel}: {error}")
+
+        try:
+            transcript.seek(0)
+            if member is not None:
+                file = discord.File(transcript, filename=f"{channel}.txt")
+                await member.send("Your ticket was closed, here is the transcript.", file=file)
+
+        except discord.HTTPException as error:
+            print(f"Failed to send the transcript of {channel}: {error}")
+
+        finally:
+            transcript.close()
+
+        await methods.remove_ticket(channel.id)
+        await channel.delete()
+        return True
+
     @commands.command(help="<reason>", description="Closes the ticket with a final message.")
     @commands.guild_only()
     @has_permissions(manage_channels=True)
     async def close(self, ctx, *, message=None):
         """ Ticket command to close the ticket, requires manage channel permissions """
-        select = """ SELECT user_id, channel_id FROM tickets; """
-        data = methods.send_query(select)
-        tuples = list(zip(*data))
-        channel_ids = [] if tuples == [] else tuples[1]
-        user_ids = [] if tuples == [] else tuples[0]
-        user_id = None
-
-        for channel_id in channel_ids:
-            if ctx.channel.id == channel_id:
-                index = channel_ids.index(channel_id)
-                user_id = user_ids[index]
-                break
-
-        if ctx.channel.id not in channel_ids:
+        if not await self.close_ticket(ctx.channel, ctx.message.author, message):
             await ctx.send(embed=methods.return_error(self, ctx, error="This channel is not a ticket."))
+
+    @commands.command(help="[@user] [from:YYYY-MM-DD] [to:YYYY-MM-DD] [keywords]",
+                      description="Searches the transcripts of closed tickets.",
+                      aliases=["searchtranscripts", "tsearch"])
+    @commands.guild_only()
+    @has_permissions(manage_channels=True)
+    async def transcripts(self, ctx, *, query=""):
+        """ Ticket command to search the transcript archive by owner, closing date and keywords,
+            requires manage channel permissions """
+        user_id, after, before, keywords = None, None, None, []
+        try:
+            for word in query.split():
+                mention = re.fullmatch(r"<@!?(\d+)>", word)
+                if mention is not None:
+                    user_id = int(mention.group(1))
+                elif word.lower().startswith(("from:", "to:")):
+                    key, value = word.split(":", 1)
+                    date = datetime.datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+                    if key.lower() == "from":
+                        after = date.timestamp()
+                    else:
+                        before = (date + datetime.timedelta(days=1)).timestamp()
+                else:
+                    keywords.append(word)
+
+        except ValueError:
+            description = "Invalid date, dates must be written as YYYY-MM-DD."
+            await ctx.send(embed=methods.return_error(self, ctx, error=description))
+            return
+
+        results = await methods.search_transcripts(ctx.guild.id, keywords, user_id, after, before, limit=15)
+        if not results:
+            await ctx.send(embed=methods.return_error(self, ctx, error="No transcripts were found."))
+
         else:
-            try:
-                transcript = {}
-                member = self.bot.get_user(user_id)
-                config = methods.get_config()
-                await ctx.send(f"Ticket Closed by {ctx.message.author}\nReason: {message}")
-                headers = {"Authorization": f"Bot {config['token']}"}
-                async with aiohttp.ClientSession(headers=headers) as session:
-                    async with session.get(f"https://discord.com/api/channels/{ctx.channel.id}/messages",
-                                           params={"limit": 100}) as i:
-                        if i.status == 200:
-                            data = await i.json()
-                            for line in data:
-                                date = line.get("timestamp").split("T")
-                                msg = line.get("content")
-                                author = line.get("author")
-                                user = author.get("username")
-                                tag = author.get("discriminator")
-                                transcript.update({f"[{date[0]} {date[1][:11]} UTC]": f"{user}#{tag} : {msg}\n"})
-                            values = sorted(transcript.items(), key=lambda kv: kv[0])
-                            for key, value in values:
-                                with open(f"{ctx.channel}.txt", "a", encoding="UTF-16") as f:
-                                    f.write(f"{key} {value}")
-
-                            file = discord.File(f"{ctx.channel}.txt", filename=f"{ctx.channel}.txt")
-                            await member.send("Your ticket was closed, here is the transcript.", file=file)
-                            os.remove(f"{ctx.channel}.txt")
-                            delete = f""" DELETE FROM tickets WHERE channel_id = {ctx.channel.id}; """
-                            methods.send_query(delete)
-                            await ctx.channel.delete()
-
-            except Exception as error:
-                print(error)
+            lines = []
+            for transcript_id, ticket_id, owner_id, channel_name, closed_at, size in results:
+                closed = datetime.datetime.utcfromtimestamp(closed_at).strftime("%d/%m/%Y")
+                lines.append(f"**#{transcript_id}** {channel_name} - <@{owner_id}> - {closed} - {size // 1024 + 1} KB")
+
+            title = "__Transcripts__"
+            description = "\n".join(lines) + f"\n\nUse **{methods.get_prefix()}transcript <id>** to view one."
+            await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="blue"))
+
+    @commands.command(help="<id>", description="Sends an archived ticket transcript.", aliases=["gettranscript"])
+    @commands.guild_only()
+    @has_permissions(manage_channels=True)
+    async def transcript(self, ctx, transcript_id: int = None):
+        """ Ticket command to fetch a transcript from the archive, requires manage channel permissions """
+        transcript = await methods.get_transcript(ctx.guild.id, transcript_id) if transcript_id is not None else None
+        if transcript is None:
+            await ctx.send(embed=methods.return_error(self, ctx, error="No transcript exists with that id."))
+
+        else:
+            channel_name, text = transcript
+            file = discord.File(io.BytesIO(text), filename=f"{channel_name}-{transcript_id}.txt")
+            await ctx.send(f"Transcript **#{transcript_id}**", file=file)
 
     @commands.command(help="",
                       description="""Creates an embed where users can react to open a ticket, 
@@ -213,9 +359,7 @@ class Tickets(commands.Cog):
         if name is None:
             await ctx.send(embed=methods.return_error(self, ctx, error="No name was given."))
         else:
-            channel_ids = get_channel_id()
-
-            if ctx.channel.id in channel_ids:
+            if await methods.is_ticket_channel(ctx.channel.id):
                 await channel.edit(name=name)
                 title = "__Channel Renamed__"
                 description = f"This ticket channel was renamed to {channel.mention}"
@@ -225,42 +369,52 @@ class Tickets(commands.Cog):
                 description = f"{channel.mention} is not a ticket."
                 await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-    @commands.command(help="<role>", description="Ability to add or remove roles from viewing the ticket.",
-                      aliases=["ticketrole"])
+    @commands.command(help="<add/remove> <role> [all]\n\nUse 'all' to change every open ticket at once.",
+                      description="Ability to add or remove roles from viewing the ticket.", aliases=["ticketrole"])
     @commands.guild_only()
     @has_permissions(manage_channels=True)
-    async def trole(self, ctx, method=None, role: discord.Role = None):
-        """ Ticket command to add/remove a role's ability to interact with a ticket,
+    async def trole(self, ctx, method=None, role: discord.Role = None, scope=None):
+        """ Ticket command to add/remove a role's ability to interact with a ticket, or with every open ticket,
             requires manage channel permissions """
-        channel = self.bot.get_channel(ctx.channel.id)
-        if method is None:
+        if method not in ("add", "remove"):
             description = "No type was given, please choose from 'add' or 'remove'."
             await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
-        if role is None or role not in ctx.guild.roles:
+        elif role is None or role not in ctx.guild.roles:
             await ctx.send(embed=methods.return_error(self, ctx, error="Invalid Role"))
 
-        elif method in ("add", "remove"):
-            channel_ids = get_channel_id()
-            overwrite = discord.PermissionOverwrite()
+        else:
+            allowed = method == "add"
+            overwrite = discord.PermissionOverwrite(read_messages=allowed, read_message_history=allowed,
+                                                    send_messages=allowed)
+            done = "added to" if allowed else "removed from"
 
-            if ctx.channel.id in channel_ids:
-                if method == "add":
-                    overwrite.update(read_messages=True, read_message_history=True, send_messages=True)
-                    await channel.set_permissions(role, overwrite=overwrite)
-                    title = "__Success__"
-                    description = f"{role.mention} was added to this ticket."
-                    await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
-
-                elif method == "remove":
-                    overwrite.update(read_messages=False, read_message_history=False, send_messages=False)
-                    await channel.set_permissions(role, overwrite=overwrite)
-                    title = "__Success__"
-                    description = f"{role.mention} was removed from this ticket."
-                    await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
+            if scope == "all":
+                channels = [channel for channel in map(self.bot.get_channel, await methods.get_ticket_channels())
+                            if channel is not None and channel.guild == ctx.guild]
+                semaphore = asyncio.Semaphore(self.overwrite_concurrency)
+
+                async def update(channel):
+                    async with semaphore:
+                        await self.update_overwrites(channel, {role: overwrite})
+
+                results = await asyncio.gather(*map(update, channels), return_exceptions=True)
+                failed = [result for result in results if isinstance(result, Exception)]
+                for error in failed:
+                    print(f"Failed to update a ticket's permissions: {error}")
+
+                title = "__Success__"
+                description = f"{role.mention} was {done} {len(channels) - len(failed)}/{len(channels)} tickets."
+                await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
+
+            elif await methods.is_ticket_channel(ctx.channel.id):
+                await self.update_overwrites(ctx.channel, {role: overwrite})
+                title = "__Success__"
+                description = f"{role.mention} was {done} this ticket."
+                await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="green"))
 
             else:
-                description = f"{channel.mention} is not a ticket."
+                description = f"{ctx.channel.mention} is not a ticket."
                 await ctx.send(embed=methods.return_error(self, ctx, error=description))
 
     @commands.command(help="", description="Upgrades a ticket so only that only admins can view it.",
@@ -268,15 +422,17 @@ class Tickets(commands.Cog):
     @commands.guild_only()
     @has_permissions(manage_channels=True)
     async def tupgrade(self, ctx):
-        """ Ticket command to upgrade a ticket so only admins can view, requires manage channels permissions """
-        channel = self.bot.get_channel(ctx.channel.id)
-        channel_ids = get_channel_id()
-
-        if ctx.channel.id in channel_ids:
-            for role in ctx.guild.roles:
-                overwrite = discord.PermissionOverwrite()
-                overwrite.update(read_messages=False, read_message_history=False, send_messages=False)
-                await channel.set_permissions(role, overwrite=overwrite)
+        """ Ticket command to upgrade a ticket so only admins can view, requires manage channels permissions,
+            denying @everyone hides the ticket from every role without an overwrite of its own so only the roles
+            that already have one need a deny, all of it is saved with one channel edit """
+        channel = ctx.channel
+
+        if await methods.is_ticket_channel(ctx.channel.id):
+            overwrite = discord.PermissionOverwrite(read_messages=False, read_message_history=False,
+                                                    send_messages=False)
+            roles = [ctx.guild.default_role, *(target for target in channel.overwrites
+                                               if isinstance(target, discord.Role))]
+            await self.update_overwrites(channel, dict.fromkeys(roles, overwrite))
 
             title = "__Success__"
             description = "Only users with administrator permissions can now view this ticket"
@@ -1,5 +1,7 @@
 """ User Commands file to separate all the commands that do not require any permissions to call """
+import asyncio
 import os
+import sqlite3
 from datetime import datetime
 
 import aiohttp
@@ -16,8 +18,28 @@ class Users(commands.Cog):
         self.bot = bot
         self.time_format = "%d/%B/%Y %H:%M:%S UTC"
         self.colors = {"red": 0xff5959, "green": 0x00ff40, "pink": 0xff00ff}
+        self.history_page_size = 10
+        self.case_sync_seconds = 6 * 60 * 60
+        self.sync_task = self.bot.loop.create_task(self.sync_cases())
         print(f"{self.__class__.__name__} cog loaded.")
 
+    def cog_unload(self):
+        """ Method called when the cog is unloaded to stop the audit log sync """
+        self.sync_task.cancel()
+
+    async def sync_cases(self):
+        """ Method to copy the moderation actions done outside the bot from every guild's audit log into the
+            case table once the bot is ready and then every few hours, well within the 90 days Discord keeps them """
+        await self.bot.wait_until_ready()
+        while True:
+            for guild in self.bot.guilds:
+                try:
+                    await methods.sync_audit_cases(guild)
+
+                except (discord.HTTPException, sqlite3.Error) as error:
+                    print(f"Failed to sync the audit log of {guild}: {error}")
+            await asyncio.sleep(self.case_sync_seconds)
+
     @commands.command(help="", description="Returns the latency of the bot.")
     @commands.guild_only()
     async def ping(self, ctx):
@@ -148,40 +170,32 @@ class Users(commands.Cog):
         title = "__Roles in this server__"
         await ctx.send(embed=methods.return_embed(self, ctx, title, description=role_string, color="green"))
 
-    @commands.command(help="<@user>",
-                      description="Retrieves previous 90 days of punishment history for the user from the audit logs.")
+    @commands.command(help="<@user> [page]",
+                      description="Retrieves the user's moderation history, newest first.")
     @commands.guild_only()
-    async def history(self, ctx, member: discord.Member = None):
-        """ Returns the kick, ban and unban logs for a user within the last 90 days """
+    async def history(self, ctx, member: discord.User = None, page: int = 1):
+        """ Returns a page of the bans, unbans, kicks, mutes, unmutes and purges of a user from the case table,
+            actions done outside the bot are copied in by the background audit log sync """
         if member is None:
             await ctx.send(embed=methods.return_error(self, ctx, error="No user given"))
         else:
             time_format = "%d/%B/%Y"
-            ban_history, kick_history, unban_history = "", "", ""
-
-            async for entry in ctx.guild.audit_logs(limit=None, action=discord.AuditLogAction.ban):
-                if entry.target == member:
-                    ban_history += f"*{entry.created_at.strftime(time_format)}* - {entry.user.mention} "
-                    ban_history += f"*banned* {entry.target.mention} for reason: *{entry.reason}*\n"
-
-            async for entry in ctx.guild.audit_logs(limit=None, action=discord.AuditLogAction.kick):
-                if entry.target == member:
-                    kick_history += f"*{entry.created_at.strftime(time_format)}* - {entry.user.mention} "
-                    kick_history += f"*kicked* {entry.target.mention} for reason: *{entry.reason}*\n"
-
-            async for entry in ctx.guild.audit_logs(limit=None, action=discord.AuditLogAction.unban):
-                if entry.target == member:
-                    unban_history += f"{entry.created_at.strftime(time_format)} - {entry.user.mention} "
-                    unban_history += f"*unbanned* {entry.target.mention} for reason: *{entry.reason}*\n"
-
-            ban_history = "None" if ban_history == "" else ban_history
-            kick_history = "None" if kick_history == "" else kick_history
-            unban_history = "None" if unban_history == "" else unban_history
-
-            description = f"**__Ban History:__**\n{ban_history}\n\n**__Unban History:__**\n{unban_history}\n\n"
-            description += f"**__Kick History:__**\n{kick_history}"
-
-            title = f"**Punishment History in the last 90 days for:** *{member}*"
+            page = max(1, page)
+            size = self.history_page_size
+            cases, total = await methods.get_cases(ctx.guild.id, member.id, size, (page - 1) * size)
+            pages = max(1, -(-total // size))
+            verbs = {"ban": "banned", "unban": "unbanned", "kick": "kicked", "mute": "muted", "unmute": "un-muted",
+                     "purge": "purged"}
+            description = ""
+            for case_id, moderator_id, action, reason, created_at in cases:
+                moderator = f"<@{moderator_id}>" if moderator_id is not None else "Unknown"
+                reason = reason if reason is None or len(reason) <= 100 else reason[:97] + "..."
+                description += f"`#{case_id}` *{datetime.utcfromtimestamp(created_at).strftime(time_format)}* - " \
+                               f"{moderator} *{verbs.get(action, action)}* {member.mention} for reason: *{reason}*\n"
+
+            if not description:
+                description = "None" if total == 0 else f"There are only {pages} pages."
+            title = f"**Punishment History for:** *{member}* (page {min(page, pages)}/{pages})"
             await ctx.send(embed=methods.return_embed(self, ctx, title, description, color="pink"))
 
     @commands.command(help="", description="Shows all the custom commands", aliases=["customcommands", "commands"])
@@ -1,4 +1,20 @@
+import asyncio
+import atexit
+import datetime
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
+import os
+import random
+import re
+import tempfile
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
 import discord
 import sqlite3
 
@@ -7,13 +23,158 @@ BLACKLISTED_FILE = "data/blacklisted.json"
 COMMANDS_FILE = "data/custom_cmds.json"
 REACTIONS_FILE = "data/reaction_roles.json"
 TICKET_FILE = "data/tickets.db"
+ZERO_WIDTH = dict.fromkeys(map(ord, "\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\ufeff"))
+CUSTOM_EMOJI = re.compile(r"<a?:\w+:(\d+)>")
+DURATION = re.compile(r"(\d+)([dhms])")
+DURATION_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+LEET_SPEAK = str.maketrans("0134579@$", "oieastgas")
+FILE_CHECK_INTERVAL = 1
+WRITE_DELAY = 2
+TRANSCRIPT_CHUNK_SIZE = 64 * 1024
+TRANSCRIPT_CHUNKS = 65536
+
+_json_cache = {}
+_pending_writes = {}
+_writes_in_flight = Counter()
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="json-writer")
+_flush_handle = None
+_blacklist = {"source": None, "ids": set(), "names": set()}
+_word_filter = {"source": None, "filter": None}
+_reaction_index = {"source": None, "messages": {}, "unplaced": set()}
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tickets-db")
+_db_connection = None
+_ticket_channels = None
+_opening_tickets = set()
+
+
+def _load_json(path):
+    """ Function to return a json file's data from memory, the file is only parsed again if its mtime,
+        size or content hash has changed since it was last read """
+    now = time.monotonic()
+    cached = _json_cache.get(path)
+    if cached is not None and (path in _pending_writes or _writes_in_flight[path]):
+        return cached["data"]
+
+    if cached is not None and now - cached["checked"] < FILE_CHECK_INTERVAL:
+        return cached["data"]
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if cached is not None and cached["signature"] == signature:
+        cached["checked"] = now
+        return cached["data"]
+
+    with open(path, "rb") as i:
+        raw = i.read()
+
+    digest = hashlib.sha1(raw).hexdigest()
+    if cached is None or cached["digest"] != digest:
+        cached = {"data": json.loads(raw), "digest": digest}
+        _json_cache[path] = cached
+
+    cached.update(signature=signature, checked=now)
+    return cached["data"]
+
+
+def _dump_json(path, data, ensure_ascii=False):
+    """ Function to apply a change to a json file in memory and queue it for the next write-behind flush,
+        every change made within WRITE_DELAY seconds of the first is written to disk together """
+    global _flush_handle
+    cached = _json_cache.setdefault(path, {"digest": None, "signature": None, "checked": 0})
+    cached["data"] = data
+    _pending_writes[path] = ensure_ascii
+
+    if _flush_handle is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            writes = _serialize_pending()
+            _finish_writes(writes, _write_files(writes))
+        else:
+            _flush_handle = loop.call_later(WRITE_DELAY, _start_flush, loop)
+
+
+def _serialize_pending():
+    """ Function to take a snapshot of every queued json file so it can be written outside the event loop """
+    writes = []
+    for path, ensure_ascii in _pending_writes.items():
+        raw = json.dumps(_json_cache[path]["data"], indent=4, ensure_ascii=ensure_ascii).encode("UTF-8")
+        writes.append((path, raw))
+        _writes_in_flight[path] += 1
+
+    _pending_writes.clear()
+    return writes
+
+
+def _write_files(writes):
+    """ Function to atomically replace each file by writing a temp file beside it and renaming it over,
+        returns the (path, digest, signature) of every file written, it only touches the disk so it is safe
+        to run on the writer thread """
+    written = []
+    for path, raw in writes:
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as i:
+                    i.write(raw)
+                    i.flush()
+                    os.fsync(i.fileno())
+                os.replace(temp_path, path)
+
+            except OSError:
+                os.remove(temp_path)
+                raise
+
+            stat = os.stat(path)
+            written.append((path, hashlib.sha1(raw).hexdigest(), (stat.st_mtime_ns, stat.st_size)))
+
+        except OSError as error:
+            print(f"Failed to write {path}: {error}")
+    return written
+
+
+def _finish_writes(writes, written):
+    """ Function to record what was written to disk and release the in-flight count of each file, always called
+        on the thread that serialized the writes so the cache and counter are never changed from two threads """
+    for path, digest, signature in written:
+        _json_cache[path].update(digest=digest, signature=signature, checked=time.monotonic())
+    for path, _ in writes:
+        _writes_in_flight[path] -= 1
+
+
+def _start_flush(loop):
+    """ Function called by the write-behind timer to write the queued files on the writer thread,
+        the results are recorded back on the event loop once the thread is done """
+    global _flush_handle
+    _flush_handle = None
+    writes = _serialize_pending()
+
+    def finished(future):
+        failed = future.cancelled() or future.exception() is not None
+        _finish_writes(writes, [] if failed else future.result())
+
+    loop.run_in_executor(_write_executor, _write_files, writes).add_done_callback(finished)
+
+
+def flush_writes():
+    """ Function to write every queued json change to disk immediately, used on shutdown """
+    global _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+
+    _write_executor.shutdown(wait=True)
+    writes = _serialize_pending()
+    _finish_writes(writes, _write_files(writes))
+
+
+atexit.register(flush_writes)
 
 
 def get_cmds():
     """ Function to get the custom commands from the json file """
     try:
-        with open(COMMANDS_FILE, "r") as i:
-            return json.load(i)
+        return _load_json(COMMANDS_FILE)
 
     except FileNotFoundError as error:
         print(error)
@@ -22,18 +183,16 @@ def get_cmds():
 def set_cmds(data):
     """ Function to add a new custom command to the json file """
     try:
-        with open(COMMANDS_FILE, "w") as i:
-            json.dump(data, i, indent=4, ensure_ascii=False)
+        _dump_json(COMMANDS_FILE, data)
 
     except FileNotFoundError as error:
         print(error)
 
 
 def get_config():
-    """ Function to get the config data """
+    """ Function to get the config data from memory, reloading it if the file has been edited """
     try:
-        with open(CONFIG_FILE, "r", encoding="UTF-8") as i:
-            return json.load(i)
+        return _load_json(CONFIG_FILE)
 
     except FileNotFoundError as error:
         print(error)
@@ -42,8 +201,7 @@ def get_config():
 def set_config(data):
     """ Function to write the config data """
     try:
-        with open(CONFIG_FILE, "w") as i:
-            json.dump(data, i, indent=4, ensure_ascii=False)
+        _dump_json(CONFIG_FILE, data)
 
     except FileNotFoundError as error:
         print(error)
@@ -52,8 +210,7 @@ def set_config(data):
 def get_blacklisted():
     """ Function to get the blacklisted users list """
     try:
-        with open(BLACKLISTED_FILE) as i:
-            return json.load(i)
+        return _load_json(BLACKLISTED_FILE)
 
     except FileNotFoundError as error:
         print(error)
@@ -62,58 +219,1062 @@ def get_blacklisted():
 def set_blacklisted(data):
     """ Function to append a user to the blacklisted users """
     try:
-        with open(BLACKLISTED_FILE, "w") as i:
-            json.dump(data, i, indent=4)
+        _dump_json(BLACKLISTED_FILE, data, ensure_ascii=True)
 
     except FileNotFoundError as error:
         print(error)
 
 
+def _blacklist_entries():
+    """ Function to return the blacklist as a set of user ids plus any old 'name#1234' entries,
+        the sets are only rebuilt when the blacklisted file changes """
+    data = get_blacklisted()
+    if data is not _blacklist["source"]:
+        entries = [] if data is None else data["user"]
+        _blacklist["source"] = data
+        _blacklist["ids"] = {int(entry) for entry in entries if str(entry).isdigit()}
+        _blacklist["names"] = {entry for entry in entries if not str(entry).isdigit()}
+    return _blacklist
+
+
+def _save_blacklist():
+    """ Function to queue the in-memory blacklist to be written to the blacklisted file """
+    data = {"user": sorted(_blacklist["ids"]) + sorted(_blacklist["names"])}
+    _blacklist["source"] = data
+    set_blacklisted(data)
+
+
+def is_blacklisted(user):
+    """ Function to check if a user is blacklisted, users saved by name are moved over to their id when seen """
+    blacklist = _blacklist_entries()
+    if user.id in blacklist["ids"]:
+        return True
+
+    if blacklist["names"] and str(user) in blacklist["names"]:
+        blacklist["names"].discard(str(user))
+        blacklist["ids"].add(user.id)
+        _save_blacklist()
+        return True
+    return False
+
+
+def add_blacklisted(user):
+    """ Function to blacklist a user by id, returns False if they were already blacklisted """
+    if is_blacklisted(user):
+        return False
+    _blacklist["ids"].add(user.id)
+    _save_blacklist()
+    return True
+
+
+def remove_blacklisted(user):
+    """ Function to remove a user from the blacklist, returns False if they weren't blacklisted """
+    if not is_blacklisted(user):
+        return False
+    _blacklist["ids"].discard(user.id)
+    _save_blacklist()
+    return True
+
+
+def migrate_blacklisted(members):
+    """ Function to move blacklist entries saved by 'name#1234' over to the matching members' ids """
+    blacklist = _blacklist_entries()
+    migrated = [member for member in members if blacklist["names"] and str(member) in blacklist["names"]]
+    for member in migrated:
+        blacklist["names"].discard(str(member))
+        blacklist["ids"].add(member.id)
+
+    if migrated:
+        _save_blacklist()
+
+
 def get_reaction_roles():
     """ Function to get the reaction-roles file's data """
     try:
-        with open(REACTIONS_FILE, "r", encoding="UTF-8") as i:
-            reaction_roles = json.load(i)
-            return reaction_roles
+        return _load_json(REACTIONS_FILE)
 
     except FileNotFoundError as error:
         print(error)
 
 
+def set_reaction_roles(data):
+    """ Function to write the reaction-roles file's data """
+    try:
+        _dump_json(REACTIONS_FILE, data)
+
+    except FileNotFoundError as error:
+        print(error)
+
+
+def emoji_key(emoji):
+    """ Function to turn an emoji string or a reaction's PartialEmoji into the key used by the reaction-role index,
+        custom emojis are keyed by their id and unicode emojis by the emoji itself """
+    if isinstance(emoji, str):
+        custom = CUSTOM_EMOJI.fullmatch(emoji)
+        return custom.group(1) if custom is not None else emoji.replace("\ufe0f", "")
+    return str(emoji.id) if emoji.id is not None else emoji.name.replace("\ufe0f", "")
+
+
+def get_reaction_message(message_id):
+    """ Function to get the {emoji key: role id} mapping of a reaction-role message, or None if the message
+        doesn't give roles, the index is only rebuilt when the reaction-roles file changes """
+    data = get_reaction_roles()
+    if data is not _reaction_index["source"]:
+        messages = {}
+        unplaced = set()
+        for entry in [] if data is None else data["reaction_messages"]:
+            role_ids = entry.get("role_ids", [None] * len(entry["reaction_emojis"]))
+            messages[entry["message_id"]] = dict(zip(map(emoji_key, entry["reaction_emojis"]), role_ids))
+            if entry.get("channel_id") is None:
+                unplaced.add(entry["message_id"])
+        _reaction_index.update(source=data, messages=messages, unplaced=unplaced)
+    return _reaction_index["messages"].get(message_id)
+
+
+def add_reaction_message(message, emojis, roles):
+    """ Function to save a new reaction-role message and add it to the index """
+    reaction_roles = get_reaction_roles()
+    reaction_roles["reaction_messages"].append({
+        "message_id": message.id,
+        "channel_id": message.channel.id,
+        "reaction_emojis": emojis,
+        "reaction_roles": [role.name for role in roles],
+        "role_ids": [role.id for role in roles]
+    })
+    set_reaction_roles(reaction_roles)
+    _reaction_index["messages"][message.id] = {emoji_key(emoji): role.id for emoji, role in zip(emojis, roles)}
+
+
+def set_reaction_channel(message_id, channel_id):
+    """ Function to save the channel of a reaction-role message that was saved without one, the index tells
+        which messages are missing theirs so the entries are only scanned for those """
+    get_reaction_message(message_id)
+    if message_id not in _reaction_index["unplaced"]:
+        return
+
+    reaction_roles = get_reaction_roles()
+    for entry in reaction_roles["reaction_messages"]:
+        if entry["message_id"] == message_id and entry.get("channel_id") is None:
+            entry["channel_id"] = channel_id
+    set_reaction_roles(reaction_roles)
+    _reaction_index["unplaced"].discard(message_id)
+
+
+def migrate_reaction_roles(guilds):
+    """ Function to look up the role ids of reaction-role messages that were saved with role names only """
+    reaction_roles = get_reaction_roles()
+    migrated = False
+    for entry in [] if reaction_roles is None else reaction_roles["reaction_messages"]:
+        if "role_ids" not in entry:
+            roles = {role.name: role.id for guild in guilds for role in guild.roles}
+            entry["role_ids"] = [roles.get(name) for name in entry["reaction_roles"]]
+            migrated = True
+
+    if migrated:
+        _reaction_index["source"] = None
+        set_reaction_roles(reaction_roles)
+
+
 def get_filtered():
     """ Function to get the filter words """
     try:
-        with open(CONFIG_FILE, "r") as i:
-            filter_data = json.load(i)
-            return filter_data["filtered_words"]
+        return _load_json(CONFIG_FILE)["filtered_words"]
 
     except FileNotFoundError as error:
         print(error)
 
 
+class WordFilter:
+    """ Aho-Corasick automaton built from the filtered words so a message is checked in a single pass,
+        no matter how many words are filtered """
+
+    def __init__(self, words=()):
+        """ Initialization method to build the trie from the filtered words """
+        self.goto = [{}]
+        self.fail = [0]
+        self.links = [0]
+        self.depth = [0]
+        self.counts = [0]
+        self.words = set()
+        self.dirty = False
+        for word in words:
+            self.add(word)
+
+    @staticmethod
+    def normalize(text):
+        """ Method to remove zero-width characters, case and leet-speak so 'H3\u200bllo' matches 'hello' """
+        return text.translate(ZERO_WIDTH).casefold().translate(LEET_SPEAK)
+
+    def _node(self, word):
+        """ Method to return the trie node a normalized word ends on, adding nodes for it if needed """
+        node = 0
+        for char in word:
+            if char not in self.goto[node]:
+                self.goto[node][char] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.links.append(0)
+                self.depth.append(self.depth[node] + 1)
+                self.counts.append(0)
+            node = self.goto[node][char]
+        return node
+
+    def add(self, word):
+        """ Method to add a word to the filter, the failure links are rebuilt on the next search """
+        normalized = self.normalize(word)
+        if word in self.words or not normalized:
+            return False
+        self.words.add(word)
+        self.counts[self._node(normalized)] += 1
+        self.dirty = True
+        return True
+
+    def remove(self, word):
+        """ Method to remove a word from the filter, its trie nodes are left in place but no longer match """
+        if word not in self.words:
+            return False
+        self.words.discard(word)
+        self.counts[self._node(self.normalize(word))] -= 1
+        self.dirty = True
+        return True
+
+    def _build(self):
+        """ Method to compute the failure and output links of every node with a breadth-first walk """
+        queue = deque(self.goto[0].values())
+        for node in queue:
+            self.fail[node] = self.links[node] = 0
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(char, 0)
+                self.fail[child] = fail
+                self.links[child] = fail if self.counts[fail] else self.links[fail]
+                queue.append(child)
+        self.dirty = False
+
+    def search(self, text, substrings=False):
+        """ Method to return the first filtered word found in the text, or None if it is clean,
+            unless substrings is set a match has to be a whole word """
+        if self.dirty:
+            self._build()
+
+        text = self.normalize(text)
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+
+            match = node if self.counts[node] else self.links[node]
+            while match:
+                start = index - self.depth[match] + 1
+                if substrings or ((start == 0 or not text[start - 1].isalnum())
+                                  and (index + 1 == len(text) or not text[index + 1].isalnum())):
+                    return text[start:index + 1]
+                match = self.links[match]
+        return None
+
+
+def get_word_filter():
+    """ Function to get the compiled word filter, it is only compiled again if the config file is edited by hand """
+    words = get_config()["filtered_words"]
+    if words is not _word_filter["source"]:
+        _word_filter.update(source=words, filter=WordFilter(words))
+    return _word_filter["filter"]
+
+
+def add_filtered_word(word):
+    """ Function to add a word to the filter and the config, returns False if it is already filtered """
+    config = get_config()
+    if not get_word_filter().add(word):
+        return False
+    config["filtered_words"].append(word)
+    set_config(config)
+    return True
+
+
+def remove_filtered_word(word):
+    """ Function to remove a word from the filter and the config, returns False if it isn't filtered """
+    config = get_config()
+    if not get_word_filter().remove(word):
+        return False
+    config["filtered_words"].remove(word)
+    set_config(config)
+    return True
+
+
 def get_prefix():
     """ Function to get the prefix data """
     try:
-        with open(CONFIG_FILE, "r", encoding="UTF-8") as i:
-            prefix_data = json.load(i)
-            return prefix_data["prefix"]
+        return _load_json(CONFIG_FILE)["prefix"]
 
     except FileNotFoundError as error:
         print(error)
 
 
-def send_query(select):
-    """ Function to connect and query the tickets database with sqlite3 """
-    conn = sqlite3.connect(TICKET_FILE)
-    cursor = conn.cursor()
+def parse_duration(text):
+    """ Function to turn a duration like '1d', '5h' or '1h30m' into seconds, returns None if it isn't valid """
+    text = text.lower()
+    if not text or DURATION.sub("", text):
+        return None
+    return sum(int(amount) * DURATION_UNITS[unit] for amount, unit in DURATION.findall(text)) or None
+
+
+def _connect():
+    """ Function to open the long-lived tickets database connection, only ever called on the database thread """
+    global _db_connection
+    if _db_connection is None:
+        _db_connection = sqlite3.connect(TICKET_FILE, isolation_level=None, check_same_thread=False,
+                                         cached_statements=256)
+        _db_connection.execute("PRAGMA journal_mode=WAL")
+        _db_connection.execute("PRAGMA synchronous=NORMAL")
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS tickets (
+                                       ticket_id INTEGER NOT NULL PRIMARY KEY,
+                                       user_id INTEGER NOT NULL,
+                                       channel_id INTEGER NOT NULL); """)
+        _db_connection.execute(""" CREATE INDEX IF NOT EXISTS tickets_user_id ON tickets(user_id); """)
+        _db_connection.execute(""" CREATE INDEX IF NOT EXISTS tickets_channel_id ON tickets(channel_id); """)
+        if "warning_id" not in {column[1] for column in _db_connection.execute("PRAGMA table_info(tickets)")}:
+            _db_connection.execute(""" ALTER TABLE tickets ADD COLUMN warning_id INTEGER; """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS sequences (
+                                       name TEXT NOT NULL PRIMARY KEY,
+                                       value INTEGER NOT NULL); """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS giveaways (
+                                       message_id INTEGER NOT NULL PRIMARY KEY,
+                                       channel_id INTEGER NOT NULL,
+                                       host_id INTEGER NOT NULL,
+                                       prize TEXT NOT NULL,
+                                       ends_at INTEGER NOT NULL,
+                                       ended INTEGER NOT NULL DEFAULT 0,
+                                       winner_count INTEGER NOT NULL DEFAULT 1); """)
+        _db_connection.execute(""" CREATE INDEX IF NOT EXISTS giveaways_running ON giveaways(ended, ends_at); """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS giveaway_winners (
+                                       message_id INTEGER NOT NULL,
+                                       user_id INTEGER NOT NULL,
+                                       PRIMARY KEY(message_id, user_id)) WITHOUT ROWID; """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS jobs (
+                                       job_id INTEGER PRIMARY KEY,
+                                       kind TEXT NOT NULL,
+                                       guild_id INTEGER NOT NULL,
+                                       channel_id INTEGER,
+                                       message_id INTEGER,
+                                       options TEXT NOT NULL,
+                                       done INTEGER NOT NULL DEFAULT 0,
+                                       failed INTEGER NOT NULL DEFAULT 0,
+                                       status TEXT NOT NULL DEFAULT 'running'); """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS job_items (
+                                       job_id INTEGER NOT NULL,
+                                       item_id INTEGER NOT NULL,
+                                       PRIMARY KEY(job_id, item_id)) WITHOUT ROWID; """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS cases (
+                                       case_id INTEGER PRIMARY KEY,
+                                       guild_id INTEGER NOT NULL,
+                                       user_id INTEGER,
+                                       moderator_id INTEGER,
+                                       action TEXT NOT NULL,
+                                       reason TEXT,
+                                       created_at INTEGER NOT NULL,
+                                       audit_id INTEGER); """)
+        _db_connection.execute(""" CREATE INDEX IF NOT EXISTS cases_user ON cases(guild_id, user_id, created_at); """)
+        _db_connection.execute(""" CREATE UNIQUE INDEX IF NOT EXISTS cases_audit_id ON cases(audit_id); """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS punishments (
+                                       guild_id INTEGER NOT NULL,
+                                       user_id INTEGER NOT NULL,
+                                       kind TEXT NOT NULL,
+                                       expires_at INTEGER NOT NULL,
+                                       PRIMARY KEY(guild_id, user_id, kind)) WITHOUT ROWID; """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS lockdowns (
+                                       guild_id INTEGER NOT NULL,
+                                       channel_id INTEGER NOT NULL,
+                                       overwrites TEXT NOT NULL,
+                                       PRIMARY KEY(guild_id, channel_id)) WITHOUT ROWID; """)
+        _db_connection.execute(""" CREATE TABLE IF NOT EXISTS transcripts (
+                                       transcript_id INTEGER PRIMARY KEY,
+                                       guild_id INTEGER NOT NULL,
+                                       ticket_id INTEGER NOT NULL,
+                                       user_id INTEGER NOT NULL,
+                                       closed_by INTEGER NOT NULL,
+                                       channel_name TEXT NOT NULL,
+                                       closed_at INTEGER NOT NULL,
+                                       size INTEGER NOT NULL,
+                                       data BLOB NOT NULL); """)
+        _db_connection.execute(""" CREATE INDEX IF NOT EXISTS transcripts_guild_user_id
+                                       ON transcripts(guild_id, user_id, closed_at); """)
+        _db_connection.execute(""" CREATE INDEX IF NOT EXISTS transcripts_guild_closed_at
+                                       ON transcripts(guild_id, closed_at); """)
+        try:
+            _db_connection.execute(""" CREATE VIRTUAL TABLE IF NOT EXISTS transcript_chunks
+                                           USING fts5(text, content=''); """)
+
+        except sqlite3.OperationalError as error:
+            print(f"Transcript keyword search is unavailable, this SQLite build has no FTS5: {error}")
+    return _db_connection
+
+
+def _run_query(query, params, fetch):
+    """ Function to run a single statement, statements that write are wrapped in their own transaction """
+    conn = _connect()
+    try:
+        if fetch:
+            return conn.execute(query, params).fetchall()
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(query, params)
+        return cursor.rowcount
+
+    except sqlite3.OperationalError as error:
+        print(f"Tickets database error: {error}")
+        return [] if fetch else None
+
+
+def _run_transaction(function, args):
+    """ Function to call function(connection, *args) inside one transaction, rolled back if it raises """
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return function(conn, *args)
+
+
+async def fetch_query(query, params=()):
+    """ Function to run a SELECT on the tickets database thread and return every row """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _run_query, query, params, True)
+
+
+async def send_query(query, params=()):
+    """ Function to run an INSERT, UPDATE or DELETE on the tickets database thread and commit it """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _run_query, query, params, False)
+
+
+async def run_transaction(function, *args):
+    """ Function to run several statements on the tickets database thread as a single transaction """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _run_transaction, function, args)
+
+
+async def get_ticket_channels():
+    """ Function to get the in-memory set of ticket channel ids,
+        the set is loaded from the database the first time it is needed and kept in sync afterwards """
+    global _ticket_channels
+    if _ticket_channels is None:
+        rows = await fetch_query(""" SELECT channel_id FROM tickets; """)
+        _ticket_channels = {channel_id for channel_id, in rows}
+    return _ticket_channels
+
+
+async def is_ticket_channel(channel_id):
+    """ Function to check if a channel is a ticket without touching the database """
+    return channel_id in await get_ticket_channels()
+
+
+async def get_ticket_by_channel(channel_id):
+    """ Function to get the (ticket_id, user_id, channel_id) row for a ticket channel, or None """
+    if not await is_ticket_channel(channel_id):
+        return None
+    rows = await fetch_query(""" SELECT ticket_id, user_id, channel_id FROM tickets WHERE channel_id = ?; """,
+                             (channel_id,))
+    return rows[0] if rows else None
+
+
+async def get_ticket_by_user(user_id):
+    """ Function to get the (ticket_id, user_id, channel_id) row of a user's open ticket, or None """
+    rows = await fetch_query(""" SELECT ticket_id, user_id, channel_id FROM tickets WHERE user_id = ? LIMIT 1; """,
+                             (user_id,))
+    return rows[0] if rows else None
+
+
+def _next_ticket_number(conn):
+    """ Function to increment and return the ticket number sequence, seeded from the highest saved ticket """
+    conn.execute(""" INSERT OR IGNORE INTO sequences(name, value)
+                     SELECT 'tickets', MAX(COALESCE(MAX(ticket_id), 0), 1000) FROM tickets; """)
+    conn.execute(""" UPDATE sequences SET value = value + 1 WHERE name = 'tickets'; """)
+    return conn.execute(""" SELECT value FROM sequences WHERE name = 'tickets'; """).fetchone()[0]
+
+
+async def reserve_ticket(user_id):
+    """ Function to claim the next ticket number for a user, returns None if the user already has a ticket
+        open or is in the middle of opening one, release_ticket must be called once the ticket is saved """
+    if user_id in _opening_tickets:
+        return None
+
+    _opening_tickets.add(user_id)
+    try:
+        if await get_ticket_by_user(user_id) is None:
+            return await run_transaction(_next_ticket_number)
+
+    except Exception:
+        release_ticket(user_id)
+        raise
+
+    release_ticket(user_id)
+    return None
+
+
+def release_ticket(user_id):
+    """ Function to release a user's claim from reserve_ticket """
+    _opening_tickets.discard(user_id)
+
+
+async def add_ticket(ticket_id, user_id, channel_id):
+    """ Function to save a newly opened ticket """
+    await get_ticket_channels()
+    insert = """ INSERT INTO tickets(ticket_id, user_id, channel_id) VALUES(?, ?, ?); """
+    await send_query(insert, (ticket_id, user_id, channel_id))
+    _ticket_channels.add(channel_id)
+
 
+async def set_ticket_warning(channel_id, message_id):
+    """ Function to save the id of a ticket's inactivity warning, or clear it with None """
+    await send_query(""" UPDATE tickets SET warning_id = ? WHERE channel_id = ?; """, (message_id, channel_id))
+
+
+async def get_ticket_warnings():
+    """ Function to get the {channel_id: warning message id} of every ticket that has been warned """
+    rows = await fetch_query(""" SELECT channel_id, warning_id FROM tickets WHERE warning_id IS NOT NULL; """)
+    return dict(rows)
+
+
+async def remove_ticket(channel_id):
+    """ Function to delete a ticket's data, skipping the database entirely if the channel isn't a ticket """
+    if await is_ticket_channel(channel_id):
+        _ticket_channels.discard(channel_id)
+        await send_query(""" DELETE FROM tickets WHERE channel_id = ?; """, (channel_id,))
+
+
+def _archive_transcript(conn, guild_id, ticket_id, user_id, closed_by, channel_name, transcript):
+    """ Function to compress and save a transcript file and add its text to the keyword index, the file is read
+        a line at a time and indexed in chunks of about TRANSCRIPT_CHUNK_SIZE bytes so it is never fully loaded,
+        each chunk's rowid is the transcript id times TRANSCRIPT_CHUNKS plus the chunk number """
+    cursor = conn.execute(""" INSERT INTO transcripts(guild_id, ticket_id, user_id, closed_by, channel_name,
+                                                      closed_at, size, data)
+                              VALUES(?, ?, ?, ?, ?, ?, 0, x''); """,
+                          (guild_id, ticket_id, user_id, closed_by, channel_name, int(time.time())))
+    transcript_id = cursor.lastrowid
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    compressed, lines, chunk_size, size, chunk_number, indexed = [], [], 0, 0, 0, True
+
+    def add_chunk():
+        nonlocal indexed
+        chunk = b"".join(lines)
+        compressed.append(compressor.compress(chunk))
+        if indexed:
+            try:
+                conn.execute(""" INSERT INTO transcript_chunks(rowid, text) VALUES(?, ?); """,
+                             (transcript_id * TRANSCRIPT_CHUNKS + chunk_number, chunk.decode("utf-8", "replace")))
+
+            except sqlite3.OperationalError:
+                indexed = False
+
+    for line in transcript:
+        lines.append(line)
+        chunk_size += len(line)
+        size += len(line)
+        if chunk_size >= TRANSCRIPT_CHUNK_SIZE and chunk_number < TRANSCRIPT_CHUNKS - 1:
+            add_chunk()
+            lines, chunk_size, chunk_number = [], 0, chunk_number + 1
+    if lines:
+        add_chunk()
+
+    compressed.append(compressor.flush())
+    conn.execute(""" UPDATE transcripts SET size = ?, data = ? WHERE transcript_id = ?; """,
+                 (size, b"".join(compressed), transcript_id))
+    return transcript_id
+
+
+async def archive_transcript(guild_id, ticket_id, user_id, closed_by, channel_name, transcript):
+    """ Function to archive the UTF-8 transcript file of a closed ticket, the file is read on the database thread,
+        returns the transcript id """
+    return await run_transaction(_archive_transcript, guild_id, ticket_id, user_id, closed_by, channel_name,
+                                 transcript)
+
+
+async def search_transcripts(guild_id, keywords=None, user_id=None, after=None, before=None, limit=10):
+    """ Function to search a guild's transcript archive, newest first, by keywords, ticket owner and closing time,
+        returns (transcript_id, ticket_id, user_id, channel_name, closed_at, size) rows """
+    clauses, params = ["guild_id = ?"], [guild_id]
+    for keyword in keywords or ():
+        clauses.append(f"transcript_id IN (SELECT rowid / {TRANSCRIPT_CHUNKS} FROM transcript_chunks "
+                       "WHERE transcript_chunks MATCH ?)")
+        params.append('"' + keyword.replace('"', '""') + '"')
+    if user_id is not None:
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    if after is not None:
+        clauses.append("closed_at >= ?")
+        params.append(int(after))
+    if before is not None:
+        clauses.append("closed_at < ?")
+        params.append(int(before))
+
+    query = f""" SELECT transcript_id, ticket_id, user_id, channel_name, closed_at, size FROM transcripts
+                 WHERE {' AND '.join(clauses)} ORDER BY closed_at DESC LIMIT ?; """
+    return await fetch_query(query, (*params, limit))
+
+
+def _read_transcript(guild_id, transcript_id):
+    """ Function to load and decompress an archived transcript on the database thread """
+    row = _connect().execute(""" SELECT channel_name, data FROM transcripts
+                                 WHERE transcript_id = ? AND guild_id = ?; """, (transcript_id, guild_id)).fetchone()
+    return None if row is None else (row[0], gzip.decompress(row[1]))
+
+
+async def get_transcript(guild_id, transcript_id):
+    """ Function to get the (channel_name, UTF-8 text) of one of a guild's archived transcripts, or None """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, _read_transcript, guild_id, transcript_id)
+
+
+async def add_giveaway(message_id, channel_id, host_id, prize, ends_at, winner_count=1):
+    """ Function to save a newly started giveaway """
+    insert = """ INSERT INTO giveaways(message_id, channel_id, host_id, prize, ends_at, winner_count)
+                 VALUES(?, ?, ?, ?, ?, ?); """
+    await send_query(insert, (message_id, channel_id, host_id, prize, ends_at, winner_count))
+
+
+async def get_giveaway(message_id):
+    """ Function to get the (message_id, channel_id, host_id, prize, ends_at, ended, winner_count) row of a giveaway,
+        or None """
+    rows = await fetch_query(""" SELECT message_id, channel_id, host_id, prize, ends_at, ended, winner_count
+                                 FROM giveaways WHERE message_id = ?; """, (message_id,))
+    return rows[0] if rows else None
+
+
+async def get_running_giveaways():
+    """ Function to get the rows of every giveaway that hasn't ended, soonest first """
+    return await fetch_query(""" SELECT message_id, channel_id, host_id, prize, ends_at, ended, winner_count
+                                 FROM giveaways WHERE ended = 0 ORDER BY ends_at; """)
+
+
+async def get_giveaway_winners(message_id):
+    """ Function to get the ids of everyone who has already won a giveaway, including re-rolls """
+    rows = await fetch_query(""" SELECT user_id FROM giveaway_winners WHERE message_id = ?; """, (message_id,))
+    return {user_id for user_id, in rows}
+
+
+def _add_giveaway_winners(conn, message_id, user_ids):
+    """ Function to save the winners of a giveaway """
+    conn.executemany(""" INSERT OR IGNORE INTO giveaway_winners(message_id, user_id) VALUES(?, ?); """,
+                     [(message_id, user_id) for user_id in user_ids])
+
+
+async def add_giveaway_winners(message_id, user_ids):
+    """ Function to save the winners of a giveaway so a re-roll can't pick them again """
+    await run_transaction(_add_giveaway_winners, message_id, user_ids)
+
+
+async def end_giveaway(message_id):
+    """ Function to mark a giveaway as ended """
+    await send_query(""" UPDATE giveaways SET ended = 1 WHERE message_id = ?; """, (message_id,))
+
+
+async def create_job(kind, guild_id, channel_id, message_id, options):
+    """ Function to save a new bulk job and return its id, options is anything json can store """
+    def insert(conn):
+        return conn.execute(""" INSERT INTO jobs(kind, guild_id, channel_id, message_id, options)
+                                VALUES(?, ?, ?, ?, ?); """,
+                            (kind, guild_id, channel_id, message_id, json.dumps(options))).lastrowid
+    return await run_transaction(insert)
+
+
+async def get_running_jobs(kind):
+    """ Function to get the (job_id, guild_id, channel_id, message_id, options, done, failed) rows of every
+        unfinished job of a kind, so they can be resumed """
+    rows = await fetch_query(""" SELECT job_id, guild_id, channel_id, message_id, options, done, failed FROM jobs
+                                 WHERE kind = ? AND status = 'running'; """, (kind,))
+    return [(*row[:4], json.loads(row[4]), *row[5:]) for row in rows]
+
+
+async def get_job_items(job_id):
+    """ Function to get the ids of the items a job has already finished """
+    rows = await fetch_query(""" SELECT item_id FROM job_items WHERE job_id = ?; """, (job_id,))
+    return {item_id for item_id, in rows}
+
+
+async def get_guild_jobs(guild_id):
+    """ Function to get the (job_id, kind, done, failed) rows of a guild's unfinished jobs """
+    return await fetch_query(""" SELECT job_id, kind, done, failed FROM jobs
+                                 WHERE guild_id = ? AND status = 'running'; """, (guild_id,))
+
+
+def _save_job(conn, job_id, item_ids, done, failed, status):
+    """ Function to save a job's newly finished items and its counts in one transaction """
+    conn.executemany(""" INSERT OR IGNORE INTO job_items(job_id, item_id) VALUES(?, ?); """,
+                     [(job_id, item_id) for item_id in item_ids])
+    conn.execute(""" UPDATE jobs SET done = ?, failed = ?, status = ? WHERE job_id = ?; """,
+                 (done, failed, status, job_id))
+    if status != "running":
+        conn.execute(""" DELETE FROM job_items WHERE job_id = ?; """, (job_id,))
+
+
+async def save_job(job_id, item_ids, done, failed, status="running"):
+    """ Function to save a job's progress, the finished item list is dropped once the job is no longer running """
+    await run_transaction(_save_job, job_id, item_ids, done, failed, status)
+
+
+async def add_case(guild_id, user_id, moderator_id, action, reason=None):
+    """ Function to record a moderation action done by the bot, user_id is None for actions without a target """
+    insert = """ INSERT INTO cases(guild_id, user_id, moderator_id, action, reason, created_at)
+                 VALUES(?, ?, ?, ?, ?, ?); """
+    await send_query(insert, (guild_id, user_id, moderator_id, action, reason, int(time.time())))
+
+
+async def get_cases(guild_id, user_id, limit, offset=0):
+    """ Function to get a page of a user's (case_id, moderator_id, action, reason, created_at) cases, newest first,
+        and how many cases they have in total """
+    total = await fetch_query(""" SELECT COUNT(*) FROM cases WHERE guild_id = ? AND user_id = ?; """,
+                              (guild_id, user_id))
+    rows = await fetch_query(""" SELECT case_id, moderator_id, action, reason, created_at
+                                 FROM cases WHERE guild_id = ? AND user_id = ?
+                                 ORDER BY created_at DESC, case_id DESC LIMIT ? OFFSET ?; """,
+                             (guild_id, user_id, limit, offset))
+    return rows, total[0][0]
+
+
+def _add_audit_cases(conn, guild_id, cases, last_id):
+    """ Function to save the cases read from the audit log and the newest entry id that was read """
+    conn.executemany(""" INSERT OR IGNORE INTO cases(guild_id, user_id, moderator_id, action, reason, created_at,
+                         audit_id) VALUES(?, ?, ?, ?, ?, ?, ?); """,
+                     [(guild_id, *case) for case in cases])
+    conn.execute(""" INSERT OR REPLACE INTO sequences(name, value) VALUES(?, ?); """, (f"audit_{guild_id}", last_id))
+
+
+async def sync_audit_cases(guild):
+    """ Function to record the bans, unbans, kicks, mutes and unmutes done outside the bot since the last sync,
+        the audit log is read newest first and only until the last entry seen, the bot's own actions are skipped
+        as they are recorded when they happen """
+    rows = await fetch_query(""" SELECT value FROM sequences WHERE name = ?; """, (f"audit_{guild.id}",))
+    last_id = rows[0][0] if rows else 0
+    actions = {discord.AuditLogAction.ban: "ban", discord.AuditLogAction.unban: "unban",
+               discord.AuditLogAction.kick: "kick"}
+    muted_role = discord.utils.get(guild.roles, name=get_config()["muted_role"])
+    cases, newest_id = [], last_id
+
+    async for entry in guild.audit_logs(limit=None):
+        if entry.id <= last_id:
+            break
+        newest_id = max(newest_id, entry.id)
+        if entry.user is None or entry.user.id == guild.me.id:
+            continue
+
+        action = actions.get(entry.action)
+        if entry.action == discord.AuditLogAction.member_role_update and muted_role is not None:
+            if muted_role.id in {role.id for role in getattr(entry.after, "roles", None) or ()}:
+                action = "mute"
+            elif muted_role.id in {role.id for role in getattr(entry.before, "roles", None) or ()}:
+                action = "unmute"
+
+        if action is not None and entry.target is not None:
+            created_at = int(entry.created_at.replace(tzinfo=datetime.timezone.utc).timestamp())
+            cases.append((entry.target.id, entry.user.id, action, entry.reason, created_at, entry.id))
+
+    if newest_id != last_id:
+        await run_transaction(_add_audit_cases, guild.id, cases, newest_id)
+    return len(cases)
+
+
+async def add_punishment(guild_id, user_id, kind, expires_at):
+    """ Function to save when a timed 'mute' or 'ban' expires, replacing any earlier expiry """
+    insert = """ INSERT OR REPLACE INTO punishments(guild_id, user_id, kind, expires_at) VALUES(?, ?, ?, ?); """
+    await send_query(insert, (guild_id, user_id, kind, expires_at))
+
+
+async def remove_punishment(guild_id, user_id, kind):
+    """ Function to delete a timed punishment once it has expired or was lifted by hand """
+    await send_query(""" DELETE FROM punishments WHERE guild_id = ? AND user_id = ? AND kind = ?; """,
+                     (guild_id, user_id, kind))
+
+
+async def get_punishments():
+    """ Function to get the (guild_id, user_id, kind, expires_at) rows of every pending timed punishment """
+    return await fetch_query(""" SELECT guild_id, user_id, kind, expires_at FROM punishments; """)
+
+
+def _save_lockdown(conn, guild_id, snapshots):
+    """ Function to save the overwrite snapshots of a lockdown """
+    conn.executemany(""" INSERT OR REPLACE INTO lockdowns(guild_id, channel_id, overwrites) VALUES(?, ?, ?); """,
+                     [(guild_id, channel_id, json.dumps(overwrites)) for channel_id, overwrites in snapshots])
+
+
+async def save_lockdown(guild_id, snapshots):
+    """ Function to save the overwrites of every channel about to be locked, as (channel_id, overwrites) pairs
+        where overwrites is a list of [target id, "role" or "member", allow, deny] """
+    await run_transaction(_save_lockdown, guild_id, snapshots)
+
+
+async def get_lockdown(guild_id):
+    """ Function to get the (channel_id, overwrites) snapshots of a guild's lockdown, empty if it isn't locked """
+    rows = await fetch_query(""" SELECT channel_id, overwrites FROM lockdowns WHERE guild_id = ?; """, (guild_id,))
+    return [(channel_id, json.loads(overwrites)) for channel_id, overwrites in rows]
+
+
+def _remove_lockdown(conn, guild_id, channel_ids):
+    """ Function to delete the snapshots of restored channels """
+    conn.executemany(""" DELETE FROM lockdowns WHERE guild_id = ? AND channel_id = ?; """,
+                     [(guild_id, channel_id) for channel_id in channel_ids])
+
+
+async def remove_lockdown(guild_id, channel_ids):
+    """ Function to delete the snapshots of the channels that were restored """
+    await run_transaction(_remove_lockdown, guild_id, channel_ids)
+
+
+def close_database():
+    """ Function to wait for any queued queries and close the tickets database, used on shutdown """
+    _db_executor.shutdown(wait=True)
+    if _db_connection is not None:
+        _db_connection.close()
+
+
+atexit.register(close_database)
+
+
+async def sample_weighted(items, count, weight):
+    """ Function to pick up to count items from an async iterator without holding it in memory, each item is
+        picked with a chance proportional to weight(item) and items weighing 0 are skipped, this is weighted
+        reservoir sampling (A-Res) so only the count best keys are ever kept """
+    reservoir = []
+    order = itertools.count()
+    async for item in items:
+        item_weight = weight(item)
+        if item_weight > 0:
+            key = random.random() ** (1 / item_weight)
+            if len(reservoir) < count:
+                heapq.heappush(reservoir, (key, next(order), item))
+            elif key > reservoir[0][0]:
+                heapq.heapreplace(reservoir, (key, next(order), item))
+    return [item for _, _, item in sorted(reservoir, reverse=True)]
+
+
+class Scheduler:
+    """ Single timer task that awaits callback(key) once each key's unix time has passed, the keys are kept in
+        a min-heap so only the earliest one is ever waited on, rescheduling a key pushes a new entry and the
+        stale one is skipped when it reaches the top """
+
+    def __init__(self, callback):
+        """ Initialization method to create the empty heap """
+        self.callback = callback
+        self.heap = []
+        self.times = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def __len__(self):
+        """ Method to get the number of scheduled keys """
+        return len(self.times)
+
+    def schedule(self, key, when):
+        """ Method to schedule or reschedule a key for the given unix time """
+        self.times[key] = when
+        heapq.heappush(self.heap, (when, next(self.counter), key))
+        if len(self.heap) > 2 * len(self.times) + 64:
+            self.heap = [(when, next(self.counter), key) for key, when in self.times.items()]
+            heapq.heapify(self.heap)
+        if self.heap[0][2] == key:
+            self.wakeup.set()
+
+    def cancel(self, key):
+        """ Method to unschedule a key, its heap entry is dropped once it reaches the top """
+        self.times.pop(key, None)
+
+    def start(self, loop):
+        """ Method to start the timer task """
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.run())
+
+    def stop(self):
+        """ Method to stop the timer task, the schedule is kept """
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        """ Timer loop that sleeps until the earliest key is due or an earlier key is scheduled """
+        while True:
+            while self.heap and self.times.get(self.heap[0][2]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, key = heapq.heappop(self.heap)
+            del self.times[key]
+            try:
+                await self.callback(key)
+
+            except Exception as error:
+                print(f"Scheduled task for {key} failed: {error}")
+
+
+async def fetch_message(bot, channel_id, message_id):
+    """ Function to fetch a message by its channel and id, returns None if either was deleted """
+    channel = bot.get_channel(channel_id)
     try:
-        cursor.execute(select)
-        conn.commit()
-        return cursor.fetchall()
+        return await channel.fetch_message(message_id) if channel is not None else None
+
+    except discord.NotFound:
+        return None
+
+
+async def get_resumable_jobs(bot, kind):
+    """ Function to get the (guild, progress message, job_id, options, done, failed, finished ids) of every
+        unfinished job of a kind that isn't already running, for the cogs to resume """
+    jobs = []
+    for job_id, guild_id, channel_id, message_id, options, done, failed in await get_running_jobs(kind):
+        guild = bot.get_guild(guild_id)
+        if guild is not None and job_id not in BulkJob.running:
+            message = await fetch_message(bot, channel_id, message_id)
+            jobs.append((guild, message, job_id, options, done, failed, await get_job_items(job_id)))
+    return jobs
+
+
+class JobRunner:
+    """ Set of the background tasks running a cog's bulk jobs, runners maps each job kind to the coroutine
+        function that runs it, called with the tuples from get_resumable_jobs """
+
+    def __init__(self, bot, runners):
+        """ Initialization method to create the empty task set """
+        self.bot = bot
+        self.runners = runners
+        self.tasks = set()
+
+    def start(self, coroutine):
+        """ Method to run a job in the background until it finishes or the runner is stopped """
+        task = self.bot.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def resume(self):
+        """ Method to restart every job of the runner's kinds that was interrupted by a restart or reload """
+        await self.bot.wait_until_ready()
+        for kind, runner in self.runners.items():
+            for job in await get_resumable_jobs(self.bot, kind):
+                self.start(runner(*job))
+
+    def stop(self):
+        """ Method to cancel the running jobs, their progress is saved so resume picks them up again """
+        for task in self.tasks:
+            task.cancel()
+
+
+def job_progress(self, title, message, action):
+    """ Function to create the progress callback of a bulk job, which edits the job's progress message """
+    async def progress(job):
+        description = f"{job.done}/{job.total} {action}."
+        if job.failed:
+            description += f"\n{job.failed} failed."
+        if job.status != "running":
+            description += f"\n\n**{job.status.capitalize()}.**"
+
+        color = "pink" if job.status == "running" else "green"
+        if message is not None:
+            try:
+                await message.edit(embed=return_embed(self, message, title, description, color=color))
+
+            except discord.HTTPException as error:
+                print(f"Failed to update the progress of job {job.job_id}: {error}")
+        else:
+            print(f"{title} (job {job.job_id}): {description}")
+    return progress
+
+
+class BulkJob:
+    """ Resumable bulk operation over (item_id, item) pairs, a small pool of workers awaits action(item) for each
+        one, finished ids are saved in batches alongside the progress so an interrupted job can skip them when it
+        is resumed, and a 429 that got past discord.py's own retries pauses every worker before trying again """
+    running = {}
+
+    def __init__(self, job_id, items, action, concurrency=4, progress=None, progress_seconds=5, done=0, failed=0):
+        """ Initialization method to set up the job, progress is an optional coroutine function called with
+            the job every progress_seconds and once it has finished """
+        self.job_id = job_id
+        self.items = items
+        self.action = action
+        self.concurrency = concurrency
+        self.progress = progress
+        self.progress_seconds = progress_seconds
+        self.total = done + failed + len(items)
+        self.done = done
+        self.failed = failed
+        self.finished = []
+        self.status = "running"
+        self.paused_until = 0
+
+    def cancel(self):
+        """ Method to stop the job once the items in progress are finished """
+        self.status = "cancelled"
+
+    async def save(self):
+        """ Method to save the finished items and the counts """
+        finished, self.finished = self.finished, []
+        await save_job(self.job_id, finished, self.done, self.failed, self.status)
+
+    async def report(self):
+        """ Background task that saves the progress and reports it every progress_seconds """
+        while True:
+            await asyncio.sleep(self.progress_seconds)
+            await self.save()
+            if self.progress is not None:
+                await self.progress(self)
+
+    async def worker(self, pending):
+        """ Worker that takes the next item until the job runs out or is cancelled """
+        for item_id, item in pending:
+            if self.status != "running":
+                break
+
+            for attempt in range(5):
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    await self.action(item)
+                    self.done += 1
+
+                except discord.HTTPException as error:
+                    if error.status == 429 and attempt < 4:
+                        headers = getattr(error.response, "headers", None) or {}
+                        retry_after = float(headers.get("Retry-After", 2 ** attempt))
+                        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                        continue
+                    self.failed += 1
+                    if not isinstance(error, discord.Forbidden):
+                        print(f"Job {self.job_id} failed on {item_id}: {error}")
+
+                except Exception as error:
+                    self.failed += 1
+                    print(f"Job {self.job_id} failed on {item_id}: {error}")
+                break
+            self.finished.append(item_id)
+
+    async def run(self):
+        """ Method to run the job until every item is finished or it is cancelled """
+        BulkJob.running[self.job_id] = self
+        reporter = asyncio.get_running_loop().create_task(self.report())
+        try:
+            pending = iter(self.items)
+            await asyncio.gather(*(self.worker(pending) for _ in range(max(1, self.concurrency))))
+            if self.status == "running":
+                self.status = "done"
 
-    except sqlite3.OperationalError:
-        print("Database or table not found.")
+        finally:
+            reporter.cancel()
+            BulkJob.running.pop(self.job_id, None)
+            await self.save()
+            if self.status != "running" and self.progress is not None:
+                await self.progress(self)
 
 
 def return_error(self, ctx, title="__Error__", error=None):
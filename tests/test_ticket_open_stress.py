@@ -0,0 +1,54 @@
+""" Stress test for ticket number allocation, fires hundreds of simultaneous opens at a scratch database """
+import asyncio
+import random
+
+import pytest
+
+import methods
+
+
+@pytest.fixture
+def scratch_database(tmp_path, monkeypatch):
+    """ Fixture to point the tickets database at an empty file for the duration of a test """
+    monkeypatch.setattr(methods, "TICKET_FILE", str(tmp_path / "tickets.db"))
+    monkeypatch.setattr(methods, "_db_connection", None)
+    monkeypatch.setattr(methods, "_ticket_channels", None)
+    monkeypatch.setattr(methods, "_opening_tickets", set())
+    yield
+    if methods._db_connection is not None:
+        methods._db_executor.submit(methods._db_connection.close).result()
+
+
+async def open_ticket(user_id, channels):
+    """ Stand-in for Tickets.ticket, a random delay takes the place of creating the channel """
+    ticket_number = await methods.reserve_ticket(user_id)
+    if ticket_number is None:
+        return None
+
+    try:
+        await asyncio.sleep(random.uniform(0, 0.05))
+        channel_id = len(channels) + 1
+        channels.append(channel_id)
+        await methods.add_ticket(ticket_number, user_id, channel_id)
+
+    finally:
+        methods.release_ticket(user_id)
+    return ticket_number
+
+
+def test_simultaneous_opens_never_collide(scratch_database):
+    """ 300 users each open a ticket twice at once, every user must get exactly one unique number """
+    users = list(range(1, 301)) * 2
+    random.shuffle(users)
+    channels = []
+
+    async def run():
+        numbers = await asyncio.gather(*(open_ticket(user_id, channels) for user_id in users))
+        rows = await methods.fetch_query(""" SELECT ticket_id, user_id FROM tickets; """)
+        return [number for number in numbers if number is not None], rows
+
+    numbers, rows = asyncio.run(run())
+    assert len(numbers) == len(set(numbers)) == 300
+    assert sorted(numbers) == list(range(1001, 1301))
+    assert len(channels) == 300
+    assert sorted(user_id for _, user_id in rows) == list(range(1, 301))